@@ -0,0 +1,201 @@
+"""Benchmarks for Puzzle's texture codecs.
+
+Times the LZ11 compressor (at each compression level) and decompressor in
+lz77, their nsmblib equivalents if nsmblib is installed, and the RGB4A3
+decoder and encoder in puzzle. The corpus is fixed: a synthetic texture, an
+all-transparent one, and one drawn from the PNGs in Icons/. Tileset
+archives (*.arc) or raw RGB4A3 textures can be added on the command line.
+
+For each codec and texture, prints the throughput in MB/s of uncompressed
+texture (best of --repeat runs), the compression ratio where there is one,
+and the peak memory the call allocates (as seen by tracemalloc, so
+QImage pixel buffers aren't counted).
+
+Results can be saved as JSON with --save. With --compare, they are checked
+against an earlier run, and the exit status is 1 if anything got more than
+--threshold slower or compresses worse.
+
+    python benchmark.py [--levels fast,balanced] [--save new.json]
+                        [--compare old.json] [textures]
+
+Without a display, run it with QT_QPA_PLATFORM=offscreen.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import archive
+import lz77
+import puzzle
+import texcorpus
+
+try:
+    import nsmblib
+    HaveNSMBLib = True
+except ImportError:
+    HaveNSMBLib = False
+
+
+def LoadTexture(path):
+    """Loads the uncompressed texture from a tileset archive, or a raw
+    texture file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if path.lower().endswith('.arc'):
+        arc = archive.U8.load(data.decode('latin-1'))
+        for key, value in arc.files:
+            if key.startswith('BG_tex/') and key.endswith('_tex.bin.LZ'):
+                return lz77.LZS11().Decompress11LZS(bytes(arc[key], 'latin-1'))
+        raise ValueError('%s has no texture' % path)
+
+    return data
+
+
+def Measure(func, arg, repeat):
+    """Returns the best time of repeat calls to func(arg), the peak memory
+    of one more call, and what func returned"""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        taken = time.perf_counter() - start
+        if best is None or taken < best: best = taken
+
+    tracemalloc.start()
+    func(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak, result
+
+
+def Codecs(levels):
+    """Returns (name, function, input kind, output kind) for every codec.
+    Input and output kinds are 'raw' (RGB4A3 texture), 'lz' (LZ11 stream),
+    or 'image' (QImage)"""
+    codecs = []
+    for level in levels:
+        codecs.append(('lz77.Compress11LZS[%s]' % level,
+            lambda data, level=level: lz77.LZS11().Compress11LZS(data, level=level), 'raw', 'lz'))
+    codecs.append(('lz77.Decompress11LZS', lambda data: lz77.LZS11().Decompress11LZS(data), 'lz', 'raw'))
+    context = puzzle.TextureDecodeContext()
+    codecs.append(('lz77.Decompress11LZS[context]',
+        lambda data: lz77.LZS11().Decompress11LZS(data, context), 'lz', 'raw'))
+
+    if HaveNSMBLib:
+        codecs.append(('nsmblib.compress11LZS', nsmblib.compress11LZS, 'raw', 'lz'))
+        codecs.append(('nsmblib.decompress11LZS', nsmblib.decompress11LZS, 'lz', 'raw'))
+        codecs.append(('nsmblib.decodeTileset', nsmblib.decodeTileset, 'raw', None))
+
+    codecs.append(('puzzle.RGB4A3Decode', puzzle.RGB4A3Decode, 'raw', 'image'))
+    codecs.append(('puzzle.RGB4A3Decode[context]',
+        lambda data: puzzle.RGB4A3Decode(data, True, context), 'raw', 'image'))
+    codecs.append(('puzzle.RGB4A3Encode', puzzle.RGB4A3Encode, 'image', 'raw'))
+    return codecs
+
+
+def Run(textures, levels, repeat):
+    """Runs every codec over every texture, printing and returning the
+    results keyed by 'texture/codec'"""
+    results = {}
+    print('%-42s %10s %8s %10s' % ('texture/codec', 'MB/s', 'ratio', 'peak KiB'))
+
+    for texname, raw in textures:
+        inputs = {
+            'raw': raw,
+            'lz': lz77.LZS11().Compress11LZS(raw, level=lz77.DefaultCompressionLevel),
+            'image': puzzle.RGB4A3Decode(raw),
+            }
+
+        for name, func, kind, output in Codecs(levels):
+            seconds, peak, result = Measure(func, inputs[kind], repeat)
+
+            entry = {
+                'seconds': seconds,
+                'mbps': len(raw) / seconds / 1e6,
+                'peak_kib': peak / 1024,
+                }
+            if output == 'lz':
+                entry['ratio'] = len(result) / len(raw)
+
+            key = texname + '/' + name
+            results[key] = entry
+            print('%-42s %10.2f %8s %10.0f' % (key, entry['mbps'],
+                '%.4f' % entry['ratio'] if 'ratio' in entry else '-', entry['peak_kib']))
+
+    return results
+
+
+def Compare(results, baseline, threshold):
+    """Prints every result that regressed against baseline, and returns
+    whether there were any"""
+    regressed = False
+    for key, entry in sorted(results.items()):
+        if key not in baseline: continue
+        old = baseline[key]
+
+        if entry['mbps'] < old['mbps'] * (1 - threshold):
+            print('REGRESSION %s: %.2f MB/s, was %.2f' % (key, entry['mbps'], old['mbps']))
+            regressed = True
+        if 'ratio' in entry and 'ratio' in old and entry['ratio'] > old['ratio'] + 1e-9:
+            print('REGRESSION %s: ratio %.4f, was %.4f' % (key, entry['ratio'], old['ratio']))
+            regressed = True
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the texture codecs')
+    parser.add_argument('textures', nargs='*', help='extra tileset archives or raw RGB4A3 textures')
+    parser.add_argument('--levels', default='store,fast,balanced,maximum',
+        help='comma-separated compression levels to time (default: all but squeeze)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the best one counts')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier run to check the results against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+        help='fraction of throughput that may be lost before it counts as a regression')
+    args = parser.parse_args()
+
+    levels = args.levels.split(',')
+    for level in levels:
+        if level not in lz77.CompressionLevels:
+            parser.error('unknown compression level: ' + level)
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+
+    textures = [
+        ('synthetic', texcorpus.MakeTexture(0)),
+        ('transparent', bytes(524288)),
+        ('icons', texcorpus.MakeIconsTexture()),
+        ]
+    for path in args.textures:
+        textures.append((os.path.basename(path), LoadTexture(path)))
+
+    results = Run(textures, levels, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'nsmblib': HaveNSMBLib,
+                'results': results,
+                }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if Compare(results, baseline, args.threshold):
+            sys.exit(1)
+        print('No regressions against ' + args.compare)
+
+
+if __name__ == '__main__': main()
@@ -1,5 +1,57 @@
+import multiprocessing
 import struct
-import ctypes
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Named Compress11LZS settings, from fastest to smallest. 'store' only
+# emits literals, which the game reads fine but doesn't shrink anything;
+# 'squeeze' tries all of the SqueezeSettings (see LZS11.Squeeze11LZS).
+CompressionLevels = {
+    'store': dict(parser='store'),
+    'fast': dict(parser='greedy', chainDepth=4),
+    'balanced': dict(parser='lazy', chainDepth=16),
+    'maximum': dict(parser='optimal', chainDepth=128),
+    'squeeze': dict(parser='squeeze'),
+    }
+DefaultCompressionLevel = 'balanced'
+
+# Settings tried by LZS11.Squeeze11LZS. Which one wins depends on the
+# texture, so they are spread over every parser and match finder setting
+SqueezeSettings = [
+    dict(parser='optimal', chainDepth=128),
+    dict(parser='optimal', chainDepth=1024),
+    dict(parser='lazy', chainDepth=16),
+    dict(parser='lazy', chainDepth=128, lazyThreshold=0x11),
+    dict(parser='lazy', chainDepth=128, lazyThreshold=0x111),
+    dict(parser='greedy', chainDepth=1024),
+    dict(parser='greedy', chainDepth=128, minMatch=4),
+    ]
+
+
+class DecodeContext(object):
+    """Reusable output buffer for decoding many streams one after another,
+    as batch tools do. Pass the same context to every Decompress11LZS call
+    and the output goes into a buffer that is only ever grown, instead of a
+    new one each time. Whatever a call returns is only valid until the
+    context is used again. puzzle.TextureDecodeContext adds the images and
+    scratch arrays for decoding textures."""
+    def __init__(self):
+        self.buffer = bytearray()
+    
+    def Buffer(self, size):
+        """Returns a buffer of at least size bytes"""
+        if len(self.buffer) < size:
+            # a new buffer rather than resizing, as the old one may still
+            # be exported through a memoryview
+            self.buffer = bytearray(size)
+        return self.buffer
+
+
+class CompressionCancelled(Exception):
+    """Raised by LZS11 compression after LZS11.Cancel was called"""
+    pass
+
 
 class LZS11(object):
     def __init__(self):
@@ -8,164 +60,993 @@ class LZS11(object):
     	self.curr_size = 0
     	self.compressed = True
     	self.outdata = []
-    def Decompress11LZS( self , filein ):
-    	offset = 0
-    	# check that file is < 2GB
-    	#print "length of file: 0x%x" % len(filein)
-    	assert len(filein) < ( 0x4000 * 0x4000 * 2 )
-    	self.magic = struct.unpack('<B', filein[0:1])[0]
-    	#print "magic = 0x%x" % self.magic
-    	assert self.magic == 0x11
-    	self.decomp_size = struct.unpack('<I', filein[offset:offset+4])[0] >> 8
-    	offset += 4
-    	assert self.decomp_size <= 0x200000
-    	if ( self.decomp_size == 0 ):
-    		self.decomp_size = struct.unpack('<I', filein[offset:offset+4])[0]
-    		offset += 4
-    	assert self.decomp_size <= 0x200000 << 8
-    
-    	#print "Decompressing 0x%x. (outsize: 0x%x)" % (len(filein), self.decomp_size)
-    	self.outdata = [0 for x in range(self.decomp_size)]
-    
-    	while self.curr_size < self.decomp_size and offset < len(filein):
-    		flags = struct.unpack('<B', filein[offset:offset+1])[0]
-    		offset += 1
-    
-    		for i in range( 8 ):
-    			x = 7 - i
-    			if self.curr_size >= self.decomp_size:
-    				break
-    			if (flags & (1 << x)) > 0:
-    				first = struct.unpack('<B', filein[offset:offset+1])[0]
-    				offset += 1
-    				second = struct.unpack('<B', filein[offset:offset+1])[0]
-    				offset += 1
-    
-    				if first < 0x20:
-    					third = struct.unpack('<B', filein[offset:offset+1])[0]
-    					offset += 1
-    
-    					if first >= 0x10:
-    						fourth = struct.unpack('<B', filein[offset:offset+1])[0]
-    						offset += 1
-    
-    						pos = (((third & 0xF) << 8) | fourth) + 1
-    						copylen = ((second << 4) | ((first & 0xF) << 12) | (third >> 4)) + 273
-    					else:
-    						pos = (((second & 0xF) << 8) | third) + 1
-    						copylen = (((first & 0xF) << 4) | (second >> 4)) + 17
-    				else:
-    					pos = (((first & 0xF) << 8) | second) + 1
-    					copylen = (first >> 4) + 1
-    
-    				for y in range( copylen ):
-    					self.outdata[self.curr_size + y] = self.outdata[self.curr_size - pos + y]
-    
-    				self.curr_size += copylen
-    			else:
-    
-    				self.outdata[self.curr_size] = struct.unpack('<B', filein[offset:offset+1])[0]
-    				offset += 1
-    				self.curr_size += 1
-    
-    			if offset >= len(filein) or self.curr_size >= self.decomp_size:
-    				break
-    	return self.outdata
-
-    def Compress11LZS(self, data):
+    	self.bytesSaved = 0
+    	self.progress = None
+    	self.callback = None
+    	self.cancelled = False
+    	self.cancelEvent = None
+    	self.checkpoints = []
+    	self.checkpointInterval = 0x1000
+    def Decompress11LZS(self, filein, context=None):
+        """Decompresses an LZSS 0x11 stream (bytes, bytearray or memoryview)
+        and returns the data as bytes. Given a DecodeContext, the data is
+        decoded into its buffer instead, and a memoryview of it is returned,
+        which is only valid until the context is used again."""
+        filein = memoryview(filein).cast('B')
+        inlength = len(filein)
+        # check that file is < 2GB
+        assert inlength < ( 0x4000 * 0x4000 * 2 )
+        self.magic = filein[0]
+        assert self.magic == 0x11
+        self.decomp_size = filein[1] | (filein[2] << 8) | (filein[3] << 16)
+        offset = 4
+        assert self.decomp_size <= 0x200000
+        if ( self.decomp_size == 0 ):
+            self.decomp_size = struct.unpack_from('<I', filein, offset)[0]
+            offset += 4
+        assert self.decomp_size <= 0x200000 << 8
+        
+        decomp_size = self.decomp_size
+        if context is None:
+            outdata = bytearray(decomp_size)
+        else:
+            outdata = context.Buffer(decomp_size)
+        curr_size = 0
+        
+        while curr_size < decomp_size and offset < inlength:
+            flags = filein[offset]
+            offset += 1
+            
+            for x in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if flags & x:
+                    first = filein[offset]
+                    second = filein[offset+1]
+                    
+                    if first < 0x20:
+                        third = filein[offset+2]
+                        
+                        if first >= 0x10:
+                            fourth = filein[offset+3]
+                            offset += 4
+                            
+                            pos = (((third & 0xF) << 8) | fourth) + 1
+                            copylen = ((second << 4) | ((first & 0xF) << 12) | (third >> 4)) + 273
+                        else:
+                            offset += 3
+                            pos = (((second & 0xF) << 8) | third) + 1
+                            copylen = (((first & 0xF) << 4) | (second >> 4)) + 17
+                    else:
+                        offset += 2
+                        pos = (((first & 0xF) << 8) | second) + 1
+                        copylen = (first >> 4) + 1
+                    
+                    if copylen > decomp_size - curr_size:
+                        copylen = decomp_size - curr_size
+                    copystart = curr_size - pos
+                    assert copystart >= 0
+                    
+                    if copylen <= pos:
+                        outdata[curr_size:curr_size+copylen] = outdata[copystart:copystart+copylen]
+                        curr_size += copylen
+                    else:
+                        # the copy overlaps its own output, so the bytes
+                        # repeat every pos bytes; copy what's already there,
+                        # doubling the chunk each time
+                        while copylen > 0:
+                            chunk = curr_size - copystart
+                            if chunk > copylen:
+                                chunk = copylen
+                            outdata[curr_size:curr_size+chunk] = outdata[copystart:copystart+chunk]
+                            curr_size += chunk
+                            copylen -= chunk
+                else:
+                    outdata[curr_size] = filein[offset]
+                    offset += 1
+                    curr_size += 1
+                
+                if offset >= inlength or curr_size >= decomp_size:
+                    break
+        
+        self.curr_size = curr_size
+        if context is None:
+            self.outdata = bytes(outdata)
+        else:
+            # a truncated stream leaves zeros, as with a fresh buffer
+            outdata[curr_size:decomp_size] = bytes(decomp_size - curr_size)
+            self.outdata = memoryview(outdata)[:decomp_size]
+        return self.outdata
+
+    def Compress11LZS(self, data, chainDepth=32, reference=False, parser='greedy', lazyThreshold=0x20, minMatch=3, processes=1, segmentSize=0x10000, level=None, compareGreedy=False):
+        """Compresses data (bytes, bytearray or memoryview) using LZSS 0x11
+        and returns the stream as bytes.
+        chainDepth limits how many earlier matches the hash-chain match finder
+        looks at per position, and minMatch is the shortest match it
+        reports. Pass reference=True to use the original
+        (slow, exhaustive) LzWindowDictionary instead.
+        parser picks how matches are turned into tokens: 'greedy' takes the
+        longest match at each position, 'lazy' first checks whether the next
+        position has a longer one (for matches shorter than lazyThreshold),
+        and 'optimal' picks the smallest stream (see ParseOptimal). 'store'
+        doesn't look for matches at all, and 'squeeze' runs Squeeze11LZS
+        (with processes as the number of workers).
+        level, if given, is the name of one of the CompressionLevels and
+        replaces all of those settings.
+        With processes > 1, data is cut into segments of segmentSize bytes
+        which are parsed in that many worker processes (see
+        CompressSegments).
+        With compareGreedy=True and the lazy or optimal parser, data is also
+        compressed greedily with the same match finder settings first, which
+        takes a while longer, and self.bytesSaved is set to how much smaller
+        the result is than that stream.
+        Afterwards, self.checkpoints holds the points Recompress11LZS can
+        resume from."""
+        if level is not None:
+            assert level in CompressionLevels, 'Unknown compression level'
+            return self.Compress11LZS(data, processes=processes, segmentSize=segmentSize, compareGreedy=compareGreedy, **CompressionLevels[level])
+        
+        if parser == 'squeeze':
+            return self.Squeeze11LZS(data, processes)
+        
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        
         dcsize = len(data)
-        cbuffer = ctypes.create_string_buffer(0x1000000)
+        if dcsize > 0xFFFFFF: return None
+        
+        self.bytesSaved = 0
+        if compareGreedy and parser in ('lazy', 'optimal'):
+            greedy = self.Compress11LZS(data, chainDepth, reference, 'greedy', minMatch=minMatch, processes=processes, segmentSize=segmentSize)
+        
+        settings = dict(chainDepth=chainDepth, reference=reference, parser=parser, lazyThreshold=lazyThreshold, minMatch=minMatch)
+        if processes > 1 and dcsize > segmentSize:
+            tokens = self.CompressSegments(data, settings, processes, segmentSize)
+        else:
+            tokens = self.Tokenize(data, 0, **settings)
+        
+        result = self.EmitTokens(data, tokens)
+        if compareGreedy and parser in ('lazy', 'optimal'):
+            self.bytesSaved = len(greedy) - len(result)
+        return result
+
+    def Recompress11LZS(self, data, olddata, oldcompressed, checkpoints, processes=1, segmentSize=0x10000, level=None, **settings):
+        """Compresses data, which is an edited version of olddata, reusing
+        as much of oldcompressed (the stream of olddata, with the
+        checkpoints recorded while making it) as possible. Only the input
+        from the last checkpoint safely before the first changed byte
+        onwards is compressed again; the rest of the stream is copied over.
+        Takes the same settings as Compress11LZS, including level. With the
+        store, greedy and lazy parsers, the result is identical to
+        compressing data from scratch with the same settings, processes and
+        segmentSize."""
+        if level is not None:
+            assert level in CompressionLevels, 'Unknown compression level'
+            settings = CompressionLevels[level]
         
-        src = 0
-        dest = 4
+        if settings.get('parser') == 'squeeze':
+            return self.Squeeze11LZS(data, processes)
         
-        if dcsize > 0xFFFFFFFF: return None
+        if not isinstance(data, bytes):
+            data = bytes(data)
         
-        lzdict = LzWindowDictionary()
+        dcsize = len(data)
+        if dcsize > 0xFFFFFF: return None
+        
+        first = firstDifference(data, olddata)
+        if first == dcsize == len(olddata):
+            self.checkpoints = list(checkpoints)
+            return oldcompressed
+        
+        # checkpoints are only valid after a 4-byte header
+        if oldcompressed[1:4] == b'\0\0\0' or not checkpoints:
+            checkpoints = [(0, 4)]
+        
+        # the tokens before a checkpoint can have read a little past it:
+        # the byte that ended a match, the 3-byte keys of the positions
+        # before it, and the lazy parser's look-ahead. So resume from one
+        # far enough back that none of them saw the changed bytes.
+        margin = settings.get('minMatch', 3) + settings.get('lazyThreshold', 0x20)
+        count = max(bisect_right(checkpoints, (first - margin, len(oldcompressed))), 1)
+        src, dest = checkpoints[count - 1]
+        
+        settings = dict(settings)
+        # a single pass would parse straight across the segment boundaries
+        # Compress11LZS would have cut the data at
+        if processes > 1 and dcsize > segmentSize and (src // segmentSize + 1) * segmentSize < dcsize:
+            tokens = self.CompressSegments(data, settings, processes, segmentSize, src)
+        else:
+            tokens = self.Tokenize(data, src, **settings)
+        
+        return self.EmitTokens(data, tokens, src, oldcompressed[:dest], checkpoints[:count - 1])
+
+    def Squeeze11LZS(self, data, processes=1, settings=SqueezeSettings):
+        """Compresses data with each of the given Compress11LZS settings, on
+        a pool of that many worker processes, and returns the smallest
+        stream that decompresses back to data. The settings it was made with
+        are left in self.squeezeSettings. Meant for release builds, where
+        only the size matters."""
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        if len(data) > 0xFFFFFF: return None
+        
+        if processes > 1:
+            jobs = [(data, s) for s in settings]
+            results = self.RunWorkers(SqueezeAttempt, jobs, processes, [1] * len(jobs), len(jobs))
+        else:
+            results = []
+            for s in settings:
+                results.append(SqueezeAttempt((data, s)))
+                self.UpdateProgressBar(len(results), len(settings))
+        
+        # smallest first, with ties going to the earlier settings
+        results.sort(key=lambda result: (len(result[0]), settings.index(result[1])))
+        for stream, s in results:
+            if LZS11().Decompress11LZS(stream) == data:
+                self.squeezeSettings = s
+                return stream
+        
+        raise RuntimeError('No squeezed stream decompressed correctly')
+
+    def Tokenize(self, data, start=0, chainDepth=32, reference=False, parser='greedy', lazyThreshold=0x20, minMatch=3):
+        """Sets up a match finder and returns the token generator of the
+        chosen parser for data[start:]. Anything before start is only used
+        as history for matches."""
+        if parser == 'store':
+            return self.ParseStore(data, start)
+        
+        if reference:
+            lzdict = LzWindowDictionary()
+        else:
+            lzdict = LzHashChainDictionary()
+            lzdict.setChainDepth(chainDepth)
         lzdict.setWindowSize(0x1000)
+        lzdict.setMinMatchAmount(minMatch)
         lzdict.setMaxMatchAmount(0xFFFF + 273)
         
-        cbuffer[0] = '\x11'
+        if start:
+            # matches can't reach further back than the window anyway
+            history = max(0, start - 0x1000)
+            lzdict.addEntryRange(data, history, start - history)
+            lzdict.slideWindow(start)
         
-        if dcsize <= 0xFFFFFF:
-            cbuffer[1] = chr(dcsize & 255)
-            cbuffer[2] = chr((dcsize >> 8) & 255)
-            cbuffer[3] = chr((dcsize >> 16) & 255)
+        if parser == 'optimal':
+            return self.ParseOptimal(data, lzdict, start)
+        elif parser == 'lazy':
+            return self.ParseLazy(data, lzdict, lazyThreshold, start)
         else:
-            return None
-            #cbuffer[4] = chr(dcsize & 255)
-            #cbuffer[5] = chr((dcsize >> 8) & 255)
-            #cbuffer[6] = chr((dcsize >> 16) & 255)
-            #cbuffer[7] = chr((dcsize >> 24) & 255)
-            #dest += 4
+            return self.ParseGreedy(data, lzdict, start)
+
+    def CompressSegments(self, data, settings, processes, segmentSize, start=0):
+        """Parses data[start:] in segments of segmentSize bytes on a pool of worker
+        processes, and yields all of their tokens in order. Segments always
+        end at multiples of segmentSize, so starting part way through (as
+        Recompress11LZS does) only shortens the first one. Each worker gets
+        its segment plus the 0x1000 bytes before it, so its matches can
+        reach back across the boundary exactly as they could in one pass;
+        matches just can't run on past the end of a segment. Flag bytes are
+        only assigned afterwards, by EmitTokens, so segment boundaries don't
+        need to line up with them."""
+        dcsize = len(data)
+        jobs = []
+        segment = start
+        while segment < dcsize:
+            end = (segment // segmentSize + 1) * segmentSize
+            history = max(0, segment - 0x1000)
+            jobs.append((data[history:end], segment - history, settings))
+            segment = end
+        
+        sizes = [len(job[0]) - job[1] for job in jobs]
+        results = self.RunWorkers(CompressSegment, jobs, processes, sizes, dcsize, start)
+        
+        for lengths, distances in results:
+            for i in range(len(lengths)):
+                yield (distances[i], lengths[i])
+
+    def RunWorkers(self, worker, jobs, processes, sizes, total, done=0):
+        """Runs worker on every job on a pool of that many worker processes
+        and returns the results in job order. sizes is how much each job
+        adds to the progress, out of total, starting from done.
+        Cancel stops the workers as well: the jobs still waiting are
+        dropped, and the running ones see the pool's cancel event at their
+        next progress update. Any exception a worker raises is raised here,
+        after stopping the rest."""
+        event = multiprocessing.Event()
+        pool = ProcessPoolExecutor(processes, initializer=StartWorker, initargs=(event,))
+        results = [None] * len(jobs)
+        try:
+            futures = {}
+            for i, job in enumerate(jobs):
+                futures[pool.submit(worker, job)] = i
+            
+            pending = set(futures)
+            while pending:
+                # wake up now and then, so cancelling doesn't wait for the
+                # next job to finish
+                finished, pending = wait(pending, 0.1, FIRST_COMPLETED)
+                self.CheckCancelled()
+                for future in finished:
+                    i = futures[future]
+                    results[i] = future.result()
+                    done += sizes[i]
+                    self.UpdateProgressBar(done, total)
+        except BaseException:
+            event.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        
+        pool.shutdown()
+        return results
+
+    def EmitTokens(self, data, tokens, start=0, prefix=None, checkpoints=None):
+        """Packs [distance, length] tokens (literals as [0, 0]) covering
+        data[start:] into an LZ11 stream, returned as bytes. prefix is the
+        stream so far (with its header) when resuming at a checkpoint, and
+        checkpoints are the ones recorded for it.
+        A checkpoint is an (input offset, output offset) pair at the start
+        of a flag byte; one is recorded in self.checkpoints about every
+        self.checkpointInterval input bytes. There is no other state to
+        save: the flag byte is empty there, and the window is simply the
+        input right before the checkpoint."""
+        dcsize = len(data)
+        if dcsize == 0:
+            # a size of 0 in the short header means a 32-bit size follows
+            self.checkpoints = []
+            return b'\x11\0\0\0\0\0\0\0'
+        
+        outbuffer = bytearray(prefix or 4)
+        outbuffer[0] = 0x11
+        outbuffer[1] = dcsize & 255
+        outbuffer[2] = (dcsize >> 8) & 255
+        outbuffer[3] = (dcsize >> 16) & 255
         
         flagrange = [7,6,5,4,3,2,1,0]
-        lastprinted = 0
+        src = start
         
-        func_search = lzdict.search
-        func_addEntry = lzdict.addEntry
-        func_addEntryRange = lzdict.addEntryRange
-        func_slideWindow = lzdict.slideWindow
-        func_chr = chr
+        self.checkpoints = list(checkpoints or [])
+        nextcheckpoint = src
+        interval = self.checkpointInterval
+        
+        func_next = next
+        func_append = outbuffer.append
+        func_checkpoint = self.checkpoints.append
         
         while src < dcsize:
-            check = src >> 12
-            if check != lastprinted:
-                self.UpdateProgressBar(check << 12, dcsize)
-                lastprinted = check
+            if src >= nextcheckpoint:
+                func_checkpoint((src, len(outbuffer)))
+                nextcheckpoint = src + interval
             
             flag = 0
-            flagpos = dest
-            cbuffer[dest] = func_chr(flag)
-            dest += 1
+            flagpos = len(outbuffer)
+            func_append(0)
             
             for i in flagrange:
-                match = func_search(data, src, dcsize)
-                if match[1] > 0:
+                match = func_next(tokens)
+                length = match[1]
+                if length > 0:
                     flag |= (1 << i)
+                    disp = match[0] - 1
                     
-                    if match[1] <= 0x10:
-                        cbuffer[dest] = func_chr((((match[1] - 1) & 0xF) << 4) | (((match[0] - 1) & 0xFFF) >> 8))
-                        cbuffer[dest+1] = func_chr((match[0] - 1) & 0xFF)
-                        dest += 2
-                    elif match[1] <= 0x110:
-                        cbuffer[dest] = func_chr(((match[1] - 17) & 0xFF) >> 4)
-                        cbuffer[dest+1] = func_chr((((match[1] - 17) & 0xF) << 4) | (((match[0] - 1) & 0xFFF) >> 8))
-                        cbuffer[dest+2] = func_chr((match[0] - 1) & 0xFF)
-                        dest += 3
+                    if length <= 0x10:
+                        func_append(((length - 1) << 4) | (disp >> 8))
+                    elif length <= 0x110:
+                        func_append((length - 17) >> 4)
+                        func_append((((length - 17) & 0xF) << 4) | (disp >> 8))
                     else:
-                        cbuffer[dest] = func_chr((1 << 4) | (((match[1] - 273) & 0xFFFF) >> 12))
-                        cbuffer[dest+1] = func_chr(((match[1] - 273) & 0xFFF) >> 4)
-                        cbuffer[dest+2] = func_chr((((match[1] - 273) & 0xF) << 4) | (((match[0] - 1) & 0xFFF) >> 8))
-                        cbuffer[dest+3] = func_chr((match[0] - 1) & 0xFF)
-                        dest += 4
+                        func_append(0x10 | ((length - 273) >> 12))
+                        func_append(((length - 273) >> 4) & 0xFF)
+                        func_append((((length - 273) & 0xF) << 4) | (disp >> 8))
+                    func_append(disp & 0xFF)
                     
-                    func_addEntryRange(data, src, match[1])
-                    func_slideWindow(match[1])
-                    src += match[1]
+                    src += length
                 else:
-                    cbuffer[dest] = data[src]
-                    
-                    func_addEntry(data, src)
-                    func_slideWindow(1)
+                    func_append(data[src])
                     src += 1
-                    dest += 1
                 
                 if src >= dcsize: break
             
-            cbuffer[flagpos] = func_chr(flag)
+            outbuffer[flagpos] = flag
+        
+        return bytes(outbuffer)
+
+    def ParseStore(self, data, start=0):
+        """Yields a literal token for every byte of data[start:]"""
+        dcsize = len(data)
+        for src in range(start, dcsize):
+            if not (src & 0xFFF):
+                self.UpdateProgressBar(src, dcsize)
+            yield [0,0]
+
+    def ParseGreedy(self, data, lzdict, start=0):
+        """Yields [distance, length] tokens for data[start:], taking the
+        longest match at each position. Literals are yielded as [0, 0]."""
+        dcsize = len(data)
+        src = start
+        lastprinted = 0
+        
+        func_search = lzdict.search
+        func_addEntry = lzdict.addEntry
+        func_addEntryRange = lzdict.addEntryRange
+        func_slideWindow = lzdict.slideWindow
+        
+        while src < dcsize:
+            check = src >> 12
+            if check != lastprinted:
+                self.UpdateProgressBar(check << 12, dcsize)
+                lastprinted = check
+            
+            match = func_search(data, src, dcsize)
+            if match[1] > 0:
+                func_addEntryRange(data, src, match[1])
+                func_slideWindow(match[1])
+                src += match[1]
+            else:
+                func_addEntry(data, src)
+                func_slideWindow(1)
+                src += 1
+            
+            yield match
+
+    def ParseLazy(self, data, lzdict, lazyThreshold, start=0):
+        """Like ParseGreedy, but a match shorter than lazyThreshold is only
+        taken if the next position doesn't have a longer one; otherwise a
+        literal is emitted and the longer match is considered instead."""
+        dcsize = len(data)
+        src = start
+        lastprinted = 0
+        
+        func_search = lzdict.search
+        func_addEntry = lzdict.addEntry
+        func_addEntryRange = lzdict.addEntryRange
+        func_slideWindow = lzdict.slideWindow
         
-        return cbuffer[0:dest]
+        match = func_search(data, src, dcsize)
+        while src < dcsize:
+            check = src >> 12
+            if check != lastprinted:
+                self.UpdateProgressBar(check << 12, dcsize)
+                lastprinted = check
+            
+            func_addEntry(data, src)
+            func_slideWindow(1)
+            
+            if match[1] > 0:
+                if match[1] < lazyThreshold:
+                    nextMatch = func_search(data, src + 1, dcsize)
+                    if nextMatch[1] > match[1]:
+                        src += 1
+                        yield [0,0]
+                        match = nextMatch
+                        continue
+                
+                func_addEntryRange(data, src + 1, match[1] - 1)
+                func_slideWindow(match[1] - 1)
+                src += match[1]
+                yield match
+            else:
+                src += 1
+                yield match
+            
+            if src < dcsize:
+                match = func_search(data, src, dcsize)
+
+    def ParseOptimal(self, data, lzdict, start=0):
+        """Yields the tokens of the smallest stream buildable from the longest
+        match at every position. Every token costs its exact encoded size
+        plus one flag bit: 1 byte for a literal, and 2, 3 or 4 bytes for a
+        match of up to 0x10, 0x110 or 0xFFFF + 273 bytes. Every length up
+        to 0x10 is tried, along with the longest few of the 3- and 4-byte
+        encodings. Like the other parsers, only data[start:] is parsed."""
+        dcsize = len(data)
+        lengths = [0] * dcsize
+        distances = [0] * dcsize
+        
+        func_search = lzdict.search
+        func_addEntry = lzdict.addEntry
+        func_slideWindow = lzdict.slideWindow
+        
+        # pass 1: the longest match at every position
+        prevLength = 0
+        for src in range(start, dcsize):
+            if not (src & 0xFFF):
+                self.UpdateProgressBar(src, dcsize)
+            
+            if prevLength > 0x20:
+                # still inside a long match; the same distance gives the
+                # rest of it, which saves searching through every position
+                prevLength -= 1
+                lengths[src] = prevLength
+                distances[src] = distances[src - 1]
+            else:
+                match = func_search(data, src, dcsize)
+                prevLength = lengths[src] = match[1]
+                distances[src] = match[0]
+            
+            func_addEntry(data, src)
+            func_slideWindow(1)
+        
+        # pass 2: cheapest way (in bits) to encode everything from each
+        # position onwards
+        cost = [0] * (dcsize + 1)
+        choice = [0] * dcsize
+        
+        for src in range(dcsize - 1, start - 1, -1):
+            if not (src & 0xFFF):
+                self.CheckCancelled()
+            
+            best = cost[src + 1] + 9
+            bestLength = 0
+            
+            length = lengths[src]
+            if length > 0:
+                if length > 0x110:
+                    for l in (length, length - 1, length - 2):
+                        if l > 0x110 and cost[src + l] + 33 < best:
+                            best = cost[src + l] + 33
+                            bestLength = l
+                    length = 0x110
+                if length > 0x10:
+                    for l in (length, length - 1, length - 2):
+                        if l > 0x10 and cost[src + l] + 25 < best:
+                            best = cost[src + l] + 25
+                            bestLength = l
+                    length = 0x10
+                for l in range(length, 2, -1):
+                    if cost[src + l] + 17 < best:
+                        best = cost[src + l] + 17
+                        bestLength = l
+            
+            cost[src] = best
+            choice[src] = bestLength
+        
+        src = start
+        while src < dcsize:
+            length = choice[src]
+            if length:
+                yield [distances[src], length]
+                src += length
+            else:
+                yield [0,0]
+                src += 1
 
     def SetProgressBar(self, prog):
         """Sets the progress window which will be autoupdated. Requires PyQt"""
         self.progress = prog
+    def SetProgressCallback(self, callback):
+        """Sets a function to be called with (current, total) as compression
+        progresses. It may be called from a worker thread"""
+        self.callback = callback
+    def Cancel(self):
+        """Makes the running compression raise CompressionCancelled at its
+        next progress update. Safe to call from another thread"""
+        self.cancelled = True
+    def CheckCancelled(self):
+        """Raises CompressionCancelled if Cancel was called, or (in a worker
+        process) if the pool's cancel event is set"""
+        if self.cancelled or (self.cancelEvent is not None and self.cancelEvent.is_set()):
+            raise CompressionCancelled()
     def UpdateProgressBar(self, current, total):
-        if self.progress == None: print('Progress: '+str(current)+' / '+str(total)+')')
+        self.CheckCancelled()
+        if self.callback != None: self.callback(current, total)
+        if self.progress == None: return
         self.progress.setLabelText('Compressing: ('+str(current)+' / '+str(total)+')')
         self.progress.setRange(0,total)
         self.progress.setValue(current)
     
+# The cancel event of the pool this process is a worker in, if any; see
+# LZS11.RunWorkers
+WorkerCancelEvent = None
+
+def StartWorker(event):
+    """Initializer for the worker processes of LZS11.RunWorkers"""
+    global WorkerCancelEvent
+    WorkerCancelEvent = event
+
+
+def CompressSegment(job):
+    """Worker for LZS11.CompressSegments. job is (data, start, settings):
+    a segment with the history before it, where the segment starts, and the
+    Compress11LZS settings. Returns the tokens as arrays of lengths and
+    distances, which are much cheaper to send back than a list."""
+    data, start, settings = job
+    lz = LZS11()
+    lz.cancelEvent = WorkerCancelEvent
+    lengths = array('I')
+    distances = array('H')
+    for match in lz.Tokenize(data, start, **settings):
+        lengths.append(match[1])
+        distances.append(match[0])
+    return lengths, distances
+
+
+def FindCheckpoints(compressed, interval=0x1000):
+    """Returns checkpoints for Recompress11LZS, as LZS11.EmitTokens records
+    them, for any LZ11 stream (such as one loaded from a file) by walking
+    its tokens."""
+    stream = memoryview(compressed)
+    assert stream[0] == 0x11, 'Not LZ11 data'
+    dcsize = stream[1] | (stream[2] << 8) | (stream[3] << 16)
+    if dcsize == 0: return []
+    
+    checkpoints = []
+    nextcheckpoint = 0
+    src = 0
+    dest = 4
+    while src < dcsize:
+        if src >= nextcheckpoint:
+            checkpoints.append((src, dest))
+            nextcheckpoint = src + interval
+        
+        flags = stream[dest]
+        dest += 1
+        for i in (7,6,5,4,3,2,1,0):
+            if flags & (1 << i):
+                indicator = stream[dest] >> 4
+                if indicator == 0:
+                    src += (((stream[dest] & 0xF) << 4) | (stream[dest+1] >> 4)) + 17
+                    dest += 3
+                elif indicator == 1:
+                    src += (((stream[dest] & 0xF) << 12) | (stream[dest+1] << 4) | (stream[dest+2] >> 4)) + 273
+                    dest += 4
+                else:
+                    src += indicator + 1
+                    dest += 2
+            else:
+                src += 1
+                dest += 1
+            
+            if src >= dcsize: break
+    
+    return checkpoints
+
+
+def SqueezeAttempt(job):
+    """Worker for LZS11.Squeeze11LZS. job is (data, settings); returns the
+    stream compressed with those settings, along with the settings"""
+    data, settings = job
+    lz = LZS11()
+    lz.cancelEvent = WorkerCancelEvent
+    return lz.Compress11LZS(data, **settings), settings
+
+
+class LZS11Decompressor(object):
+    """Incremental LZSS 0x11 decompressor. Compressed data can be fed in
+    pieces of any size, and each call to feed returns whatever output could
+    be decoded so far. Between calls only the last 0x1000 bytes of output
+    (all a back-reference can reach) and any incomplete token are kept."""
+    def __init__(self):
+        self.decomp_size = None
+        self.curr_size = 0
+        self.inbuffer = b''
+        self.window = bytearray()
+        self.flags = 0
+        self.flagbit = 0
+    
+    def finished(self):
+        """Returns True once all of the decompressed data has been output"""
+        return self.decomp_size is not None and self.curr_size >= self.decomp_size
+    
+    def feed(self, data):
+        """Decodes as much as possible of the data fed so far, and returns
+        the new output as bytes"""
+        filein = self.inbuffer + bytes(data)
+        inlength = len(filein)
+        offset = 0
+        
+        if self.decomp_size is None:
+            if inlength < 4:
+                self.inbuffer = filein
+                return b''
+            assert filein[0] == 0x11
+            decomp_size = filein[1] | (filein[2] << 8) | (filein[3] << 16)
+            offset = 4
+            if decomp_size == 0:
+                if inlength < 8:
+                    self.inbuffer = filein
+                    return b''
+                decomp_size = struct.unpack_from('<I', filein, offset)[0]
+                offset += 4
+            self.decomp_size = decomp_size
+        
+        decomp_size = self.decomp_size
+        curr_size = self.curr_size
+        flags = self.flags
+        flagbit = self.flagbit
+        
+        outdata = self.window
+        outstart = len(outdata)
+        
+        while curr_size < decomp_size:
+            if not flagbit:
+                if offset >= inlength: break
+                flags = filein[offset]
+                offset += 1
+                flagbit = 0x80
+            
+            if flags & flagbit:
+                if offset + 2 > inlength: break
+                first = filein[offset]
+                if first >= 0x20:
+                    second = filein[offset+1]
+                    offset += 2
+                    pos = (((first & 0xF) << 8) | second) + 1
+                    copylen = (first >> 4) + 1
+                elif first >= 0x10:
+                    if offset + 4 > inlength: break
+                    second, third, fourth = filein[offset+1:offset+4]
+                    offset += 4
+                    pos = (((third & 0xF) << 8) | fourth) + 1
+                    copylen = ((second << 4) | ((first & 0xF) << 12) | (third >> 4)) + 273
+                else:
+                    if offset + 3 > inlength: break
+                    second, third = filein[offset+1:offset+3]
+                    offset += 3
+                    pos = (((second & 0xF) << 8) | third) + 1
+                    copylen = (((first & 0xF) << 4) | (second >> 4)) + 17
+                
+                if copylen > decomp_size - curr_size:
+                    copylen = decomp_size - curr_size
+                curr_size += copylen
+                copystart = len(outdata) - pos
+                assert copystart >= 0
+                
+                # same chunk doubling as Decompress11LZS for overlapping copies
+                while copylen > 0:
+                    chunk = len(outdata) - copystart
+                    if chunk > copylen:
+                        chunk = copylen
+                    outdata += outdata[copystart:copystart+chunk]
+                    copylen -= chunk
+            else:
+                if offset >= inlength: break
+                outdata.append(filein[offset])
+                offset += 1
+                curr_size += 1
+            
+            flagbit >>= 1
+        
+        self.curr_size = curr_size
+        self.flags = flags
+        self.flagbit = flagbit
+        self.inbuffer = filein[offset:]
+        self.window = outdata[-0x1000:]
+        return bytes(outdata[outstart:])
+
+
+def IterDecompress11LZS(source, chunkSize=0x2000):
+    """Generator that decompresses an LZSS 0x11 stream incrementally,
+    yielding output chunks as they are decoded. source is either the whole
+    stream (read chunkSize bytes at a time) or an iterable of pieces of it,
+    such as blocks read from a file."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        stream = memoryview(source)
+        source = (stream[i:i+chunkSize] for i in range(0, len(stream), chunkSize))
+    
+    decompressor = LZS11Decompressor()
+    for piece in source:
+        output = decompressor.feed(piece)
+        if output:
+            yield output
+        if decompressor.finished():
+            return
+    
+    assert decompressor.finished(), 'LZ11 stream ended early'
+
+class LZS11Index(object):
+    """Seek index for an LZSS 0x11 stream, so any range of the output can
+    be decoded without starting from the beginning. Each checkpoint is the
+    complete state of an LZS11Decompressor at some point in the stream:
+    (input offset, output offset, flag byte, pending flag bit, last 0x1000
+    bytes of output). Build one with BuildIndex11LZS, decode with
+    DecompressRange11LZS, and keep it next to the stream with dump/load."""
+    header = struct.Struct('<4sIII')
+    entry = struct.Struct('<IIBBH')
+    
+    def __init__(self, decomp_size, interval, checkpoints):
+        self.decomp_size = decomp_size
+        self.interval = interval
+        self.checkpoints = checkpoints
+    
+    def dump(self):
+        """Returns the index as bytes"""
+        data = [self.header.pack(b'LZXI', self.decomp_size, self.interval, len(self.checkpoints))]
+        for inpos, outpos, flags, flagbit, history in self.checkpoints:
+            data.append(self.entry.pack(inpos, outpos, flags, flagbit, len(history)))
+            data.append(history)
+        return b''.join(data)
+    
+    @staticmethod
+    def load(data):
+        """Reads an index made by dump"""
+        magic, decomp_size, interval, count = LZS11Index.header.unpack_from(data, 0)
+        assert magic == b'LZXI', 'Not an LZ11 index'
+        offset = LZS11Index.header.size
+        
+        checkpoints = []
+        for i in range(count):
+            inpos, outpos, flags, flagbit, length = LZS11Index.entry.unpack_from(data, offset)
+            offset += LZS11Index.entry.size
+            checkpoints.append((inpos, outpos, flags, flagbit, bytes(data[offset:offset+length])))
+            offset += length
+        
+        return LZS11Index(decomp_size, interval, checkpoints)
+
+
+def BuildIndex11LZS(compressed, interval=0x8000):
+    """Decompresses an LZSS 0x11 stream, recording a checkpoint about every
+    interval bytes of output, and returns them as an LZS11Index. Each one
+    costs 0x1000 bytes of history, so the default makes a 512 KiB texture's
+    index about 64 KiB."""
+    stream = memoryview(compressed)
+    decompressor = LZS11Decompressor()
+    
+    # the header first, so the first checkpoint is at the very start
+    fed = 4 if stream[1] or stream[2] or stream[3] else 8
+    decompressor.feed(stream[:fed])
+    
+    # then small pieces, so checkpoints land close to where they're wanted
+    checkpoints = []
+    nextcheckpoint = 0
+    while not decompressor.finished():
+        if decompressor.curr_size >= nextcheckpoint:
+            checkpoints.append((fed - len(decompressor.inbuffer), decompressor.curr_size,
+                decompressor.flags, decompressor.flagbit, bytes(decompressor.window)))
+            nextcheckpoint = decompressor.curr_size + interval
+        
+        assert fed < len(stream), 'LZ11 stream ended early'
+        decompressor.feed(stream[fed:fed+0x100])
+        fed += 0x100
+    
+    return LZS11Index(decompressor.decomp_size, interval, checkpoints)
+
+
+def DecompressRange11LZS(compressed, index, start, end):
+    """Returns bytes start to end of the output of an LZSS 0x11 stream,
+    decoding from the last checkpoint in index (an LZS11Index) before
+    start"""
+    end = min(end, index.decomp_size)
+    if start >= end: return b''
+    
+    inpos, outpos, flags, flagbit, history = index.checkpoints[0]
+    for checkpoint in index.checkpoints:
+        if checkpoint[1] > start: break
+        inpos, outpos, flags, flagbit, history = checkpoint
+    
+    decompressor = LZS11Decompressor()
+    decompressor.decomp_size = index.decomp_size
+    decompressor.curr_size = outpos
+    decompressor.flags = flags
+    decompressor.flagbit = flagbit
+    decompressor.window = bytearray(history)
+    
+    stream = memoryview(compressed)
+    output = []
+    while decompressor.curr_size < end:
+        assert inpos < len(stream), 'LZ11 stream ended early'
+        output.append(decompressor.feed(stream[inpos:inpos+0x400]))
+        inpos += 0x400
+    
+    output = b''.join(output)
+    return output[start-outpos:end-outpos]
+
+
+def DecompressBlockRow11LZS(compressed, index, row):
+    """Returns the 8192 bytes of a 1024x256 RGB4A3 texture that make up its
+    row-th row of 4x4 blocks (pixel rows row*4 to row*4 + 3)"""
+    return DecompressRange11LZS(compressed, index, row * 8192, (row + 1) * 8192)
+
+
+def Analyze11LZS(compressed, rangeSize=0x20):
+    """Walks the tokens of an LZSS 0x11 stream and returns what it is made
+    of, as a dict that can be dumped straight to JSON: literal and match
+    counts, how many output bytes each produced, histograms of match
+    lengths and distances (in power-of-two buckets), and 'rangeCosts', the
+    compressed bytes spent on each rangeSize bytes of output. A token's
+    cost is its exact encoded size plus its flag bit, spread evenly over
+    the bytes it outputs."""
+    stream = memoryview(compressed)
+    assert stream[0] == 0x11, 'Not LZ11 data'
+    dcsize = stream[1] | (stream[2] << 8) | (stream[3] << 16)
+    dest = 4
+    if dcsize == 0:
+        dcsize = struct.unpack_from('<I', stream, 4)[0]
+        dest = 8
+    headerSize = dest
+    
+    literals = 0
+    matches = 0
+    matchBytes = 0
+    lengths = {}
+    distances = {}
+    costs = [0] * ((dcsize + rangeSize - 1) // rangeSize)
+    
+    src = 0
+    while src < dcsize:
+        flags = stream[dest]
+        dest += 1
+        for i in (7,6,5,4,3,2,1,0):
+            if flags & (1 << i):
+                indicator = stream[dest] >> 4
+                if indicator == 0:
+                    length = (((stream[dest] & 0xF) << 4) | (stream[dest+1] >> 4)) + 17
+                    disp = ((stream[dest+1] & 0xF) << 8) | stream[dest+2]
+                    bits = 25
+                elif indicator == 1:
+                    length = (((stream[dest] & 0xF) << 12) | (stream[dest+1] << 4) | (stream[dest+2] >> 4)) + 273
+                    disp = ((stream[dest+2] & 0xF) << 8) | stream[dest+3]
+                    bits = 33
+                else:
+                    length = indicator + 1
+                    disp = ((stream[dest] & 0xF) << 8) | stream[dest+1]
+                    bits = 17
+                dest += bits >> 3
+                length = min(length, dcsize - src)
+                
+                matches += 1
+                matchBytes += length
+                bucket = histogramBucket(length)
+                lengths[bucket] = lengths.get(bucket, 0) + 1
+                bucket = histogramBucket(disp + 1)
+                distances[bucket] = distances.get(bucket, 0) + 1
+                
+                # split the cost over every range the match covers
+                perbyte = bits / 8 / length
+                pos = src
+                end = src + length
+                while pos < end:
+                    rangeEnd = min(end, (pos // rangeSize + 1) * rangeSize)
+                    costs[pos // rangeSize] += (rangeEnd - pos) * perbyte
+                    pos = rangeEnd
+                src = end
+            else:
+                literals += 1
+                costs[src // rangeSize] += 9 / 8
+                dest += 1
+                src += 1
+            
+            if src >= dcsize: break
+    
+    def sortedHistogram(histogram):
+        return dict(sorted(histogram.items(), key=lambda item: int(item[0].split('-')[0])))
+    
+    return {
+        'compressedSize': len(compressed),
+        'decompressedSize': dcsize,
+        'headerSize': headerSize,
+        'literals': literals,
+        'matches': matches,
+        'literalBytes': literals,
+        'matchBytes': matchBytes,
+        'matchLengths': sortedHistogram(lengths),
+        'matchDistances': sortedHistogram(distances),
+        'rangeSize': rangeSize,
+        'rangeCosts': costs,
+        }
+
+
+def histogramBucket(value):
+    """Returns the power-of-two histogram bucket value falls in, such as
+    '16-31'"""
+    low = 1 << (value.bit_length() - 1)
+    high = (low << 1) - 1
+    return str(low) if low == high else '%d-%d' % (low, high)
+
+
+def TileCosts11LZS(analysis):
+    """Adds up the rangeCosts of an Analyze11LZS result (for a 1024x256
+    RGB4A3 tileset texture) for each of the 256 32x32 tile cells, in the
+    order tiles are stored: left to right, then top to bottom"""
+    rangeSize = analysis['rangeSize']
+    assert 0x20 % rangeSize == 0, 'Ranges must not straddle 4x4 blocks'
+    
+    tiles = [0] * 256
+    for i, cost in enumerate(analysis['rangeCosts']):
+        block = (i * rangeSize) >> 5
+        if block >= 16384: break
+        xblock = block & 0xFF
+        yblock = block >> 8
+        tiles[((yblock >> 3) << 5) | (xblock >> 3)] += cost
+    return tiles
+
+
 class LzWindowDictionary():
     def __init__(self):
         self.offsetList = []
@@ -191,7 +1072,7 @@ class LzWindowDictionary():
         matchStart = 0
         matchSize = 0
         
-        offsetListEntry = self.offsetList[ord(data[offset])]
+        offsetListEntry = self.offsetList[data[offset]]
         i = len(offsetListEntry) - 1
         
         while i >= 0:
@@ -222,7 +1103,7 @@ class LzWindowDictionary():
                 self.windowStart += amount
     
     def removeOldEntries(self, index):
-        offsetListEntry = self.offsetList[ord(index)]
+        offsetListEntry = self.offsetList[index]
         windowStart = self.windowStart
         i = 0
         
@@ -247,12 +1128,174 @@ class LzWindowDictionary():
         self.windowLength = size
     
     def addEntry(self, data, offset):
-        self.offsetList[ord(data[offset])].append(offset)
+        self.offsetList[data[offset]].append(offset)
     
     def addEntryRange(self, data, offset, length):
         i = 0
         offsetList = self.offsetList
-        func_ord = ord
         while i < length:
-            offsetList[func_ord(data[offset+i])].append(offset+i)
+            offsetList[data[offset+i]].append(offset+i)
             i += 1
+
+
+class LzHashChainDictionary():
+    """Hash-chain match finder with the same interface as LzWindowDictionary.
+    Every position is filed under its first minMatchAmount bytes; head maps
+    those bytes to the newest position and prev (a ring the size of the
+    window) links each position to the previous one with the same bytes.
+    Nothing has to be removed as the window slides: a chain walk just stops
+    at the first position that is too far back."""
+    def __init__(self):
+        self.head = {}
+        self.windowSize = 0x1000
+        self.minMatchAmount = 3
+        self.maxMatchAmount = 18
+        self.chainDepth = 32
+        self.setWindowSize(0x1000)
+    
+    def search(self, data, offset, length):
+        minMatchAmount = self.minMatchAmount
+        if (length - offset) < minMatchAmount: return [0,0]
+        
+        maxMatchAmount = self.maxMatchAmount
+        if maxMatchAmount > length - offset:
+            maxMatchAmount = length - offset
+        windowStart = offset - self.windowSize
+        if windowStart < 0: windowStart = 0
+        
+        prev = self.prev
+        mask = self.mask
+        depth = self.chainDepth
+        
+        match = [0,0]
+        matchSize = 0
+        matchStart = self.head.get(data[offset:offset+minMatchAmount], -1)
+        
+        while matchStart >= windowStart and depth > 0:
+            # a candidate can only beat the best match if it agrees on the
+            # byte right after it, so check that one first
+            if data[matchStart+matchSize] == data[offset+matchSize]:
+                size = matchLength(data, matchStart, offset, minMatchAmount, maxMatchAmount)
+                if size > matchSize:
+                    matchSize = size
+                    match[0] = offset - matchStart
+                    match[1] = size
+                    if size == maxMatchAmount: break
+            
+            matchStart = prev[matchStart & mask]
+            depth -= 1
+        
+        return match
+    
+    def slideWindow(self, amount):
+        # old positions are skipped by distance in search, so there is
+        # nothing to expire here
+        pass
+    
+    def setWindowSize(self, size):
+        self.windowSize = size
+        ringSize = 1
+        while ringSize < size:
+            ringSize <<= 1
+        self.mask = ringSize - 1
+        self.prev = [-1] * ringSize
+        self.head = {}
+    
+    def setMinMatchAmount(self, amount):
+        self.minMatchAmount = amount
+        self.head = {}
+    
+    def setMaxMatchAmount(self, amount):
+        self.maxMatchAmount = amount
+    
+    def setChainDepth(self, depth):
+        self.chainDepth = depth
+    
+    def addEntry(self, data, offset):
+        key = data[offset:offset+self.minMatchAmount]
+        head = self.head
+        self.prev[offset & self.mask] = head.get(key, -1)
+        head[key] = offset
+    
+    def addEntryRange(self, data, offset, length):
+        head = self.head
+        prev = self.prev
+        mask = self.mask
+        minMatchAmount = self.minMatchAmount
+        func_get = head.get
+        for i in range(offset, offset + length):
+            key = data[i:i+minMatchAmount]
+            prev[i & mask] = func_get(key, -1)
+            head[key] = i
+
+
+def firstDifference(a, b):
+    """Returns the offset of the first byte where a and b differ, or the
+    length of the shorter one if it's a prefix of the other"""
+    size = min(len(a), len(b))
+    start = 0
+    step = 0x1000
+    while start < size:
+        end = min(start + step, size)
+        if a[start:end] != b[start:end]:
+            for offset in range(start, end):
+                if a[offset] != b[offset]:
+                    return offset
+        start = end
+    return size
+
+
+def matchLength(data, matchStart, offset, matchSize, maxMatchAmount):
+    """Extends a match whose first matchSize bytes are known to be equal,
+    comparing slices of growing size instead of single bytes. The match
+    may overlap offset, as LZ11 copies byte by byte."""
+    step = 16
+    while step:
+        end = matchSize + step
+        if end <= maxMatchAmount and data[matchStart+matchSize:matchStart+end] == data[offset+matchSize:offset+end]:
+            matchSize = end
+            step <<= 1
+        else:
+            step >>= 1
+    return matchSize
+
+
+def main():
+    import argparse, json
+    
+    parser = argparse.ArgumentParser(description='LZ11 tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    analyze = subparsers.add_parser('analyze',
+        help='print what an LZ11 stream (or the texture in a tileset archive) is made of, as JSON')
+    analyze.add_argument('file')
+    analyze.add_argument('--range-size', type=int, default=0x20,
+        help='output bytes per cost range (default: 32, one 4x4 block)')
+    analyze.add_argument('--ranges', action='store_true', help='include the cost of every range')
+    args = parser.parse_args()
+    
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    
+    if args.file.lower().endswith('.arc'):
+        import archive
+        arc = archive.U8.load(data.decode('latin-1'))
+        for key, value in arc.files:
+            if key.startswith('BG_tex/') and key.endswith('_tex.bin.LZ'):
+                data = bytes(arc[key], 'latin-1')
+                break
+        else:
+            parser.error(args.file + ' has no texture')
+    
+    analysis = Analyze11LZS(data, args.range_size)
+    if analysis['decompressedSize'] == 524288 and 0x20 % args.range_size == 0:
+        tiles = TileCosts11LZS(analysis)
+        analysis['tileCosts'] = [[round(cost, 1) for cost in tiles[row:row+32]] for row in range(0, 256, 32)]
+    if args.ranges:
+        analysis['rangeCosts'] = [round(cost, 2) for cost in analysis['rangeCosts']]
+    else:
+        del analysis['rangeCosts']
+    
+    print(json.dumps(analysis, indent=2))
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,90 @@
+"""Benchmarks for nsmblib.
+
+By default, compresses, decompresses and decodes a number of synthetic
+1024x256 tileset textures, first one after another and then on a pool of
+threads, and prints how much faster the threaded run was. nsmblib releases
+the GIL while it works, so the speedup should come close to the number of
+threads (as long as there are that many cores).
+
+With "compress", times compress11LZS on one full 1024x256 texture: a
+synthetic one, an all-transparent one (the worst case for the match
+finder, as every position matches), and any uncompressed RGB4A3 texture
+files given.
+
+Build the module in place first, then run this from the same folder:
+    python setup.py build_ext --inplace
+    python benchmark.py [threads] [archives]
+    python benchmark.py compress [texture files]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import nsmblib
+
+# the texture corpus is shared with Puzzle's own benchmark, one folder up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from texcorpus import MakeTexture
+
+
+def Run(func, inputs, threads):
+    """Runs func over inputs, on a thread pool if threads > 1, and returns
+    the time taken"""
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(func, inputs))
+    else:
+        for data in inputs:
+            func(data)
+    return time.perf_counter() - start
+
+
+def CompressBenchmark(paths):
+    """Prints the best of five compress11LZS timings for each texture"""
+    textures = [('synthetic', MakeTexture(0)), ('transparent', bytes(524288))]
+    for path in paths:
+        with open(path, 'rb') as f:
+            textures.append((os.path.basename(path), f.read()))
+
+    print('%-22s %10s %10s' % ('texture', 'time', 'size'))
+    for name, data in textures:
+        best = None
+        for i in range(5):
+            start = time.perf_counter()
+            compressed = nsmblib.compress11LZS(data)
+            taken = time.perf_counter() - start
+            if best is None or taken < best: best = taken
+        print('%-22s %9.3fs %10d' % (name, best, len(compressed)))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compress':
+        CompressBenchmark(sys.argv[2:])
+        return
+
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    archives = int(sys.argv[2]) if len(sys.argv) > 2 else threads * 2
+
+    print('Making %d textures...' % archives)
+    textures = [MakeTexture(i) for i in range(archives)]
+    compressed = [nsmblib.compress11LZS(tex) for tex in textures]
+
+    print('%d threads, %d cores\n' % (threads, os.cpu_count() or 1))
+    print('%-22s %10s %10s %8s' % ('function', 'serial', 'threaded', 'speedup'))
+
+    tests = (
+        ('compress11LZS', nsmblib.compress11LZS, textures),
+        ('decompress11LZS', nsmblib.decompress11LZS, compressed),
+        ('decodeTileset', nsmblib.decodeTileset, textures),
+        ('decodeTilesetNoAlpha', nsmblib.decodeTilesetNoAlpha, textures),
+        )
+    for name, func, inputs in tests:
+        serial = Run(func, inputs, 1)
+        threaded = Run(func, inputs, threads)
+        print('%-22s %9.3fs %9.3fs %7.2fx' % (name, serial, threaded, serial / threaded))
+
+
+if __name__ == '__main__': main()
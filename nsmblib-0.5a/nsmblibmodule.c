@@ -1,5 +1,5 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
-#include "list.h"
 
 #define s32 signed int
 #define s16 signed short
@@ -27,9 +27,25 @@
  * 0.4: Added nsmblib_getVersion
  * 0.5: Added nsmblib_compress11LZS (thanks to puyo_tools
  *      for the original C# code)
+ * 0.6: Fixed nsmblib_compress11LZS filing every position of a match
+ *      under the first byte of the match, which produced streams that
+ *      decoded to garbage; also fixed the output buffer being too small
+ *      for incompressible data
+ *      Ported to Python 3: every function takes any object supporting
+ *      the buffer protocol (bytes, bytearray, memoryview, QImage.bits())
+ *      without copying it, and returns bytes
+ *      nsmblib_decompress11LZS now returns None for truncated data
+ *      instead of reading past the end of it
+ *      Compression, decompression and decoding release the GIL, so
+ *      several can run at once on different threads
+ *      Replaced the IntList buckets of the LZ dictionary with a hash
+ *      chain over a fixed ring, which needs no shifting or reallocation
+ *      and gives exactly the same output
+ *      nsmblib_compress11LZS writes the long header for empty data, as
+ *      a size of 0 in the short one means a 32-bit size follows
  */
 
-#define CURRENT_VERSION 5
+#define CURRENT_VERSION 6
 
 static PyObject *nsmblib_getVersion(PyObject *self, PyObject *args) {
     /* Gets the current version of the NSMB module.
@@ -40,74 +56,31 @@ static PyObject *nsmblib_getVersion(PyObject *self, PyObject *args) {
      return Py_BuildValue("i", CURRENT_VERSION);
 }
 
-static PyObject *nsmblib_decompress11LZS(PyObject *self, PyObject *args) {
-    /* Decompresses a file using LZSS 0x11 variant.
-     * Returns: str (containing the decompressed data)
-     * Parameters:
-     *  - str data (containing the compressed data)
+static int decompress11LZS(const u8 *source, const u8 *source_end, u8 *decoded, int decompsize) {
+    /* Decompresses LZSS 0x11 data (after the header) into decoded.
+     * Doesn't touch any Python objects, so it can run without the GIL.
+     * Returns: 1 on success, 0 if the data is truncated or invalid
      */
     
-    const u8 *data;
-    int datalength;
-    
-    u8 *decoded;
-    PyObject *retvalue;
-    int decompsize;
-    
-    /* used while decompressing */
     int curr_size;
-    const u8 *source;
-    u8 *dest, *end;
+    u8 *dest;
     int len, i, j, cdest, disp, flag;
     u8 b1, b2, b3, bt, flags;
     
-    /* get the arguments */
-    if (!PyArg_ParseTuple(args, "s#", &data, &datalength))
-        return NULL;
-    
-    /* parse the file itself */
-    source = data;
-    if (*(source++) != 0x11) {
-        /* it's invalid */
-        Py_INCREF(Py_None);
-        return Py_None;
-    }
-    
-    decompsize = 0;
-    for (i = 0; i < 3; i++) {
-        decompsize += (*(source++)) << (i * 8);
-    }
-    
-    if (decompsize == 0) {
-        for (i = 0; i < 4; i++) {
-            decompsize += (*(source++)) << (i * 8);
-        }
-    }
-    
-    /* if it's obviously invalid, kill it */
-    if (decompsize > 0x800000) {
-        /* fixed 8mb limit */
-        PySys_WriteStdout("Too big! %d\n", decompsize);
-        Py_INCREF(Py_None);
-        return Py_None;
-    }
-    
-    /* allocate a buffer */
-    decoded = (char*)PyMem_Malloc(decompsize);
-    if (decoded == NULL)
-        return PyErr_NoMemory();
-    
-    /* now we can start going through everything */
     dest = decoded;
-    end = &decoded[decompsize];
     curr_size = 0;
     
     while (curr_size < decompsize) {
+        if (source >= source_end)
+            return 0;
         flags = *(source++);
         
         for (i = 0; i < 8 && curr_size < decompsize; i++) {
             flag = (flags & (0x80 >> i));
             if (flag > 0) {
+                /* the first nybble tells how long the match is */
+                if (source >= source_end || source_end - source < ((*source >> 4) == 0 ? 3 : (*source >> 4) == 1 ? 4 : 2))
+                    return 0;
                 b1 = *(source++);
                 
                 switch (b1 >> 4) {
@@ -143,11 +116,9 @@ static PyObject *nsmblib_decompress11LZS(PyObject *self, PyObject *args) {
                         break;
                 }
                 
-                if (disp > curr_size) {
+                if (disp >= curr_size) {
                     /* how's that for failure? */
-                    PyMem_Free(decoded);
-                    Py_INCREF(Py_None);
-                    return Py_None;
+                    return 0;
                 }
                 
                 cdest = curr_size;
@@ -156,29 +127,110 @@ static PyObject *nsmblib_decompress11LZS(PyObject *self, PyObject *args) {
                     *(dest++) = decoded[cdest - disp - 1 + j];
                     curr_size++;
                 }
-                
-                if (curr_size > decompsize) {
-                    break;
-                }
             } else {
+                if (source >= source_end)
+                    return 0;
                 *(dest++) = *(source++);
                 curr_size++;
-                
-                if (curr_size > decompsize) {
-                    break;
-                }
             }
         }
-        
     }
     
-    /* return it */
-    retvalue = PyString_FromStringAndSize((const char*)decoded, decompsize);
-    PyMem_Free(decoded);
+    return 1;
+}
+
+static PyObject *nsmblib_decompress11LZS(PyObject *self, PyObject *args) {
+    /* Decompresses a file using LZSS 0x11 variant.
+     * Returns: bytes (containing the decompressed data)
+     * Parameters:
+     *  - buffer data (containing the compressed data)
+     */
+    
+    Py_buffer view;
+    const u8 *data;
+    Py_ssize_t datalength;
+    
+    u8 *decoded;
+    PyObject *retvalue;
+    int decompsize, i, ok;
+    const u8 *source, *source_end;
+    
+    /* get the arguments */
+    if (!PyArg_ParseTuple(args, "y*", &view))
+        return NULL;
+    
+    data = (const u8*)view.buf;
+    datalength = view.len;
+    
+    /* parse the file itself */
+    source = data;
+    source_end = data + datalength;
+    if (datalength < 4 || *(source++) != 0x11) {
+        /* it's invalid */
+        PyBuffer_Release(&view);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    
+    decompsize = 0;
+    for (i = 0; i < 3; i++) {
+        decompsize += (*(source++)) << (i * 8);
+    }
+    
+    if (decompsize == 0) {
+        if (datalength < 8) {
+            PyBuffer_Release(&view);
+            Py_INCREF(Py_None);
+            return Py_None;
+        }
+        for (i = 0; i < 4; i++) {
+            decompsize += (*(source++)) << (i * 8);
+        }
+    }
+    
+    /* if it's obviously invalid, kill it */
+    if (decompsize > 0x800000) {
+        /* fixed 8mb limit */
+        PySys_WriteStdout("Too big! %d\n", decompsize);
+        PyBuffer_Release(&view);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    
+    /* decompress straight into the bytes object we return */
+    retvalue = PyBytes_FromStringAndSize(NULL, decompsize);
+    if (retvalue == NULL) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    decoded = (u8*)PyBytes_AS_STRING(retvalue);
+    
+    /* the input stays pinned by view and nobody else can see retvalue
+     * yet, so other threads can run while we work */
+    Py_BEGIN_ALLOW_THREADS
+    ok = decompress11LZS(source, source_end, decoded, decompsize);
+    Py_END_ALLOW_THREADS
+    
+    PyBuffer_Release(&view);
     
+    if (!ok) {
+        Py_DECREF(retvalue);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    
+    /* return it */
     return retvalue;
 }
 
+/* The dictionary is a hash chain keyed on the first byte of each
+ * position: Head holds the newest position starting with each byte value,
+ * and Prev (a ring the size of the largest window) links every position
+ * to the previous one starting with the same byte. Searching walks the
+ * chain from newest to oldest and stops at the start of the window, so
+ * nothing ever needs removing, shifting or reallocating. */
+#define LZDICT_RING_SIZE 0x1000
+
 typedef struct LZDict_t {
     int WindowSize;
     int WindowStart;
@@ -186,15 +238,14 @@ typedef struct LZDict_t {
     int MinMatchAmount;
     int MaxMatchAmount;
     int BlockSize;
-    IntList OffsetList[0x100];
+    int Head[0x100];
+    int Prev[LZDICT_RING_SIZE];
 } LZDict;
 
 void LZDict_init(LZDict *dict);
-void LZDict_free(LZDict *dict);
 void LZDict_search(LZDict *dict, u8 *data, int offset, int length, int *ret1, int *ret2);
 void LZDict_slide_window(LZDict *dict, int amount);
 void LZDict_slide_block(LZDict *dict);
-void LZDict_remove_old_entries(LZDict *dict, u8 index);
 void LZDict_set_window_size(LZDict *dict, int size);
 void LZDict_set_min_match_amount(LZDict *dict, int amount);
 void LZDict_set_max_match_amount(LZDict *dict, int amount);
@@ -207,7 +258,7 @@ void LZDict_init(LZDict *dict) {
 	/* set up the dict */
 	int i;
 	for (i = 0; i < 0x100; i++) {
-		IntList_init(&(dict->OffsetList[i]));
+		dict->Head[i] = -1;
 	}
 	
 	dict->WindowSize = 0x1000;
@@ -218,21 +269,10 @@ void LZDict_init(LZDict *dict) {
 	dict->BlockSize = 0;
 }
 
-void LZDict_free(LZDict *dict) {
-	/* free the dict */
-	int i;
-	for (i = 0; i < 0x100; i++) {
-		IntList_free(&(dict->OffsetList[i]));
-	}
-}
-
 void LZDict_search(LZDict *dict, u8 *data, int offset, int length, int *ret1, int *ret2) {
-	int i;
 	int MatchStart;
 	int MatchSize;
 	
-	LZDict_remove_old_entries(dict, data[offset]);
-	
 	if (offset < dict->MinMatchAmount || length - offset < dict->MinMatchAmount) {
 		*ret1 = 0;
 		*ret2 = 0;
@@ -243,8 +283,7 @@ void LZDict_search(LZDict *dict, u8 *data, int offset, int length, int *ret1, in
 	*ret1 = 0;
 	*ret2 = 0;
 	
-	for (i = dict->OffsetList[data[offset]].Count - 1; i >= 0; i--) {
-		MatchStart = dict->OffsetList[data[offset]].Elements[i];
+	for (MatchStart = dict->Head[data[offset]]; MatchStart >= dict->WindowStart; MatchStart = dict->Prev[MatchStart & (LZDICT_RING_SIZE - 1)]) {
 		MatchSize = 1;
 		
 		while (MatchSize < dict->MaxMatchAmount && MatchSize < dict->WindowLength && MatchStart + MatchSize < offset && offset + MatchSize < length && data[offset + MatchSize] == data[MatchStart + MatchSize])
@@ -278,18 +317,10 @@ void LZDict_slide_block(LZDict *dict) {
 	dict->WindowStart += dict->BlockSize;
 }
 
-void LZDict_remove_old_entries(LZDict *dict, u8 index) {
-	int i;
-	
-	for (i = 0; i < dict->OffsetList[index].Count;) { // don't increment i
-		if (dict->OffsetList[index].Elements[i] >= dict->WindowStart)
-			break;
-		else
-			IntList_removeAt(&(dict->OffsetList[index]), 0);
-	}
-}
-
 void LZDict_set_window_size(LZDict *dict, int size) {
+	/* the chain can't reach further back than the ring */
+	if (size > LZDICT_RING_SIZE)
+		size = LZDICT_RING_SIZE;
 	dict->WindowSize = size;
 }
 
@@ -307,23 +338,27 @@ void LZDict_set_block_size(LZDict *dict, int size) {
 }
 
 void LZDict_add_entry(LZDict *dict, u8 *data, int offset) {
-	IntList_add(&(dict->OffsetList[data[offset]]), offset);
+	dict->Prev[offset & (LZDICT_RING_SIZE - 1)] = dict->Head[data[offset]];
+	dict->Head[data[offset]] = offset;
 }
 
 void LZDict_add_entry_range(LZDict *dict, u8 *data, int offset, int length) {
 	int i;
-	for (i = 0; i < length; i++)
-		IntList_add(&(dict->OffsetList[data[offset]]), offset + i);
+	for (i = offset; i < offset + length; i++) {
+		dict->Prev[i & (LZDICT_RING_SIZE - 1)] = dict->Head[data[i]];
+		dict->Head[data[i]] = i;
+	}
 }
 
 static PyObject *nsmblib_compress11LZS(PyObject *self, PyObject *args) {
     /* Compresses a file using LZSS 0x11 variant.
-     * Returns: str (containing the compressed data)
+     * Returns: bytes (containing the compressed data)
      * Parameters:
-     *  - str data (containing the decompressed data)
+     *  - buffer data (containing the decompressed data)
      */
     
-    const u8 *data;
+    Py_buffer view;
+    u8 *data;
     int datalength;
     
     u8 *src_ptr;
@@ -339,14 +374,31 @@ static PyObject *nsmblib_compress11LZS(PyObject *self, PyObject *args) {
     LZDict dict;
     
     /* get the arguments */
-    if (!PyArg_ParseTuple(args, "s#", &data, &datalength))
+    if (!PyArg_ParseTuple(args, "y*", &view))
         return NULL;
     
-    /* allocate a buffer to start with */
-    bufSize = datalength;
-    buffer = (char*)PyMem_Malloc(bufSize);
-    if (buffer == NULL)
-        return PyErr_NoMemory();
+    if (view.len > 0x70000000) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "data is too large to compress");
+        return NULL;
+    }
+    
+    data = (u8*)view.buf;
+    datalength = (int)view.len;
+    
+    /* allocate a buffer big enough for the worst case: the header,
+     * every byte as a literal and one flag byte per 8 literals;
+     * it's shrunk to the real size at the end */
+    bufSize = 8 + datalength + ((datalength + 7) / 8);
+    retvalue = PyBytes_FromStringAndSize(NULL, bufSize);
+    if (retvalue == NULL) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    buffer = (u8*)PyBytes_AS_STRING(retvalue);
+    
+    /* nothing below touches a Python object, so let other threads run */
+    Py_BEGIN_ALLOW_THREADS
     
     src_ptr = (u8*)data;
     dest_ptr = buffer;
@@ -357,8 +409,9 @@ static PyObject *nsmblib_compress11LZS(PyObject *self, PyObject *args) {
     LZDict_set_window_size(&dict, 0x1000);
     LZDict_set_max_match_amount(&dict, 0xFFFF + 273);
     
-    /* write the decomp size */
-    if (datalength <= 0xFFFFFF) {
+    /* write the decomp size; a size of 0 in the short header means a
+     * 32-bit size follows, so empty data needs the long one too */
+    if (datalength > 0 && datalength <= 0xFFFFFF) {
 		*dest_ptr++ = 0x11;
 		*dest_ptr++ = (datalength & 0xFF);
 		*dest_ptr++ = ((datalength >> 8) & 0xFF);
@@ -423,108 +476,121 @@ static PyObject *nsmblib_compress11LZS(PyObject *self, PyObject *args) {
 		*flagpos = flag;
     }
     
-    LZDict_free(&dict);
+    Py_END_ALLOW_THREADS
     
-    /* return it! */
-    retvalue = PyString_FromStringAndSize((const char*)buffer, dest_ptr - buffer);
-    PyMem_Free(buffer);
+    PyBuffer_Release(&view);
     
+    /* return it! */
+    _PyBytes_Resize(&retvalue, dest_ptr - buffer);
     return retvalue;
 }
 
+/* For each texel of a 1024x256 texture, the index of the pixel it holds:
+ * textures are stored as 4x4 blocks, left to right and then top to bottom
+ * (see texlayout.py). Built on first use, with the GIL held. */
+static unsigned int blockOrder[262144];
+static int blockOrderBuilt = 0;
+
+static const unsigned int *getBlockOrder(void) {
+    int xblock, yblock, y, x;
+    unsigned int *order = blockOrder;
+    
+    if (blockOrderBuilt)
+        return blockOrder;
+    
+    for (yblock = 0; yblock < 256; yblock += 4)
+        for (xblock = 0; xblock < 1024; xblock += 4)
+            for (y = yblock; y < yblock + 4; y++)
+                for (x = xblock; x < xblock + 4; x++)
+                    *(order++) = (y << 10) | x;
+    
+    blockOrderBuilt = 1;
+    return blockOrder;
+}
+
+
 static PyObject *nsmblib_decodeTileset(PyObject *self, PyObject *args) {
     /* Decodes an uncompressed RGB5A4 tileset into ARGB32 Premultiplied.
      * Assumes that the size of the decoded tileset is 1024x512.
-     * Returns: str (containing the decoded data)
+     * Returns: bytes (containing the decoded data)
      * Parameters:
-     *  - str texture (containing the raw texture data)
+     *  - buffer texture (containing the raw texture data)
      */
     
+    Py_buffer view;
     const char *texture;
-    int texlength;
     u8 *decoded;
     PyObject *retvalue;
     
     /* used later in the pixel loop */
     const char *pointer;
     unsigned int *output;
-    int tx, ty, i;
+    const unsigned int *order;
+    int i;
     
     /* get the arguments */
-    if (!PyArg_ParseTuple(args, "s#", &texture, &texlength))
+    if (!PyArg_ParseTuple(args, "y*", &view))
         return NULL;
     
-    if (texlength < 524288) {
+    if (view.len < 524288) {
         /* if the input string is too small, return None */
+        PyBuffer_Release(&view);
         Py_INCREF(Py_None);
         return Py_None;
     }
+    texture = (const char*)view.buf;
+    
+    /* decode straight into the bytes object we return */
+    retvalue = PyBytes_FromStringAndSize(NULL, 1048576);
+    if (retvalue == NULL) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    decoded = (u8*)PyBytes_AS_STRING(retvalue);
+    
+    /* build the block order while we still hold the GIL */
+    order = getBlockOrder();
     
-    /* allocate memory */
-    decoded = (char*)PyMem_Malloc(1048576);
-    if (decoded == NULL)
-        return PyErr_NoMemory();
+    /* loop through every texel, letting other threads run meanwhile */
+    Py_BEGIN_ALLOW_THREADS
     
-    /* loop through every tile */
-    tx = 0;
-    ty = 0;
     pointer = texture;
-    output = (int*)decoded;
+    output = (unsigned int*)decoded;
     
-    for (i = 0; i < 16384; i++) {
-        /* loop through every row in this tile */
-        int y = ty;
-        int endy = ty + 4;
+    for (i = 0; i < 262144; i++) {
+        /* calculate this pixel */
+        int pos = order[i];
+        char a = *(pointer++);
+        char b = *(pointer++);
         
-        for (; y < endy; y++) {
-            /* now loop through each pixel */
-            int sourcey = y << 10;
-            int x = tx;
-            int endx = tx + 4;
+        if ((a & 0x80) == 0) {
+            /* use alpha */
+            char alpha = (a & 0x70) << 1;
+            unsigned int x = (alpha << 24) | ((a & 0xF) << 20) | ((b & 0xF0) << 8) | ((b & 0xF) << 4);
             
-            for (; x < endx; x++) {
-                /* calculate this pixel */
-                int pos = sourcey | x;
-                char a = *(pointer++);
-                char b = *(pointer++);
-                
-                if ((a & 0x80) == 0) {
-                    /* use alpha */
-                    char alpha = (a & 0x70) << 1;
-                    unsigned int x = (alpha << 24) | ((a & 0xF) << 20) | ((b & 0xF0) << 8) | ((b & 0xF) << 4);
-                    
-                    /* this code from Qt's PREMUL() inline function in
-                     * src/gui/painting/qdrawhelper_p.h */
-                    unsigned int al = x >> 24;
-                    unsigned int t = (x & 0xff00ff) * al;
-                    t = (t + ((t >> 8) & 0xff00ff) + 0x800080) >> 8;
-                    t &= 0xff00ff;
-                    x = ((x >> 8) & 0xff) * al;
-                    x = (x + ((x >> 8) & 0xff) + 0x80);
-                    x &= 0xff00;
-                    x |= t | (al << 24);
-                    
-                    output[pos] = x;
-                    
-                } else {
-                    /* no alpha */
-                    output[pos] = 0xFF000000 | ((a & 0x7C) << 17) | ((a & 0x3) << 14) | ((b & 0xE0) << 6) | ((b & 0x1F) << 3);
-                }
-            }
-        }
-        
-        /* move the positions onwards */
-        tx += 4;
-        if (tx >= 1024) {
-            tx = 0;
-            ty += 4;
+            /* this code from Qt's PREMUL() inline function in
+             * src/gui/painting/qdrawhelper_p.h */
+            unsigned int al = x >> 24;
+            unsigned int t = (x & 0xff00ff) * al;
+            t = (t + ((t >> 8) & 0xff00ff) + 0x800080) >> 8;
+            t &= 0xff00ff;
+            x = ((x >> 8) & 0xff) * al;
+            x = (x + ((x >> 8) & 0xff) + 0x80);
+            x &= 0xff00;
+            x |= t | (al << 24);
+            
+            output[pos] = x;
+            
+        } else {
+            /* no alpha */
+            output[pos] = 0xFF000000 | ((a & 0x7C) << 17) | ((a & 0x3) << 14) | ((b & 0xE0) << 6) | ((b & 0x1F) << 3);
         }
     }
     
-    /* return it */
-    retvalue = PyString_FromStringAndSize(decoded, 1048576);
-    PyMem_Free(decoded);
+    Py_END_ALLOW_THREADS
     
+    /* return it */
+    PyBuffer_Release(&view);
     return retvalue;
 }
 
@@ -532,96 +598,85 @@ static PyObject *nsmblib_decodeTileset(PyObject *self, PyObject *args) {
 static PyObject *nsmblib_decodeTilesetNoAlpha(PyObject *self, PyObject *args) {
     /* Decodes an uncompressed RGB5A4 tileset into ARGB32 Premultiplied.
      * Assumes that the size of the decoded tileset is 1024x512.
-     * Returns: str (containing the decoded data)
+     * Returns: bytes (containing the decoded data)
      * Parameters:
-     *  - str texture (containing the raw texture data)
+     *  - buffer texture (containing the raw texture data)
      */
     
+    Py_buffer view;
     const char *texture;
-    int texlength;
     u8 *decoded;
     PyObject *retvalue;
     
     /* used later in the pixel loop */
     const char *pointer;
     unsigned int *output;
-    int tx, ty, i;
+    const unsigned int *order;
+    int i;
     
     /* get the arguments */
-    if (!PyArg_ParseTuple(args, "s#", &texture, &texlength))
+    if (!PyArg_ParseTuple(args, "y*", &view))
         return NULL;
     
-    if (texlength < 524288) {
+    if (view.len < 524288) {
         /* if the input string is too small, return None */
+        PyBuffer_Release(&view);
         Py_INCREF(Py_None);
         return Py_None;
     }
+    texture = (const char*)view.buf;
+    
+    /* decode straight into the bytes object we return */
+    retvalue = PyBytes_FromStringAndSize(NULL, 1048576);
+    if (retvalue == NULL) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    decoded = (u8*)PyBytes_AS_STRING(retvalue);
     
-    /* allocate memory */
-    decoded = (char*)PyMem_Malloc(1048576);
-    if (decoded == NULL)
-        return PyErr_NoMemory();
+    /* build the block order while we still hold the GIL */
+    order = getBlockOrder();
+    
+    /* loop through every texel, letting other threads run meanwhile */
+    Py_BEGIN_ALLOW_THREADS
     
-    /* loop through every tile */
-    tx = 0;
-    ty = 0;
     pointer = texture;
-    output = (int*)decoded;
+    output = (unsigned int*)decoded;
     
-    for (i = 0; i < 16384; i++) {
-        /* loop through every row in this tile */
-        int y = ty;
-        int endy = ty + 4;
+    for (i = 0; i < 262144; i++) {
+        /* calculate this pixel */
+        int pos = order[i];
+        char a = *(pointer++);
+        char b = *(pointer++);
         
-        for (; y < endy; y++) {
-            /* now loop through each pixel */
-            int sourcey = y << 10;
-            int x = tx;
-            int endx = tx + 4;
+        if ((a & 0x80) == 0) {
+            /* use alpha */
+            char alpha = (a & 0x70) << 1;
+            unsigned int x = (0xFF << 24) | ((a & 0xF) << 20) | ((b & 0xF0) << 8) | ((b & 0xF) << 4);
             
-            for (; x < endx; x++) {
-                /* calculate this pixel */
-                int pos = sourcey | x;
-                char a = *(pointer++);
-                char b = *(pointer++);
-                
-                if ((a & 0x80) == 0) {
-                    /* use alpha */
-                    char alpha = (a & 0x70) << 1;
-                    unsigned int x = (0xFF << 24) | ((a & 0xF) << 20) | ((b & 0xF0) << 8) | ((b & 0xF) << 4);
-                    
-                    /* this code from Qt's PREMUL() inline function in
-                     * src/gui/painting/qdrawhelper_p.h */
-                    unsigned int al = x >> 24;
-                    unsigned int t = (x & 0xff00ff) * al;
-                    t = (t + ((t >> 8) & 0xff00ff) + 0x800080) >> 8;
-                    t &= 0xff00ff;
-                    x = ((x >> 8) & 0xff) * al;
-                    x = (x + ((x >> 8) & 0xff) + 0x80);
-                    x &= 0xff00;
-                    x |= t | (al << 24);
-                    
-                    output[pos] = x;
-                    
-                } else {
-                    /* no alpha */
-                    output[pos] = 0xFF000000 | ((a & 0x7C) << 17) | ((a & 0x3) << 14) | ((b & 0xE0) << 6) | ((b & 0x1F) << 3);
-                }
-            }
-        }
-        
-        /* move the positions onwards */
-        tx += 4;
-        if (tx >= 1024) {
-            tx = 0;
-            ty += 4;
+            /* this code from Qt's PREMUL() inline function in
+             * src/gui/painting/qdrawhelper_p.h */
+            unsigned int al = x >> 24;
+            unsigned int t = (x & 0xff00ff) * al;
+            t = (t + ((t >> 8) & 0xff00ff) + 0x800080) >> 8;
+            t &= 0xff00ff;
+            x = ((x >> 8) & 0xff) * al;
+            x = (x + ((x >> 8) & 0xff) + 0x80);
+            x &= 0xff00;
+            x |= t | (al << 24);
+            
+            output[pos] = x;
+            
+        } else {
+            /* no alpha */
+            output[pos] = 0xFF000000 | ((a & 0x7C) << 17) | ((a & 0x3) << 14) | ((b & 0xE0) << 6) | ((b & 0x1F) << 3);
         }
     }
     
-    /* return it */
-    retvalue = PyString_FromStringAndSize(decoded, 1048576);
-    PyMem_Free(decoded);
+    Py_END_ALLOW_THREADS
     
+    /* return it */
+    PyBuffer_Release(&view);
     return retvalue;
 }
 
@@ -640,7 +695,15 @@ static PyMethodDef NSMBLibMethods[] = {
     {NULL, NULL, 0, NULL}
 };
 
+static struct PyModuleDef NSMBLibModule = {
+    PyModuleDef_HEAD_INIT,
+    "nsmblib",
+    "New Super Mario Bros Wii helper functions.",
+    -1,
+    NSMBLibMethods
+};
+
 PyMODINIT_FUNC
-initnsmblib(void) {
-    (void)Py_InitModule("nsmblib", NSMBLibMethods);
+PyInit_nsmblib(void) {
+    return PyModule_Create(&NSMBLibModule);
 }
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""Parity check between nsmblib and Puzzle's Python LZ11 code.
+
+For every texture in the corpus, checks that compress11LZS produces exactly
+the stream lz77's Compress11LZS does with reference=True, and that both
+nsmblib.decompress11LZS and lz77's Decompress11LZS turn that stream back
+into the input. The corpus is the textures from texcorpus (the Icons
+texture, a synthetic one, an all-transparent one and noise), some tiny
+inputs, and any uncompressed texture files given.
+
+The Python reference compressor is slow, so this takes a few minutes. The
+exit status is 1 if anything differs.
+
+Build the module in place first, then run this from the same folder:
+    python setup.py build_ext --inplace
+    python parity.py [texture files]
+"""
+
+import os
+import sys
+import time
+
+import nsmblib
+
+# lz77 and the texture corpus are in Puzzle's source folder, one folder up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lz77
+import texcorpus
+
+
+def Corpus(paths):
+    """Returns (name, data) for every input to check"""
+    corpus = [
+        ('synthetic', texcorpus.MakeTexture(0)),
+        ('transparent', bytes(524288)),
+        ('noise', texcorpus.MakeNoiseTexture(0)),
+        ]
+
+    try:
+        from PyQt5 import QtWidgets
+    except ImportError:
+        print('PyQt5 is missing, so the Icons texture is skipped')
+    else:
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+        corpus.insert(0, ('icons', texcorpus.MakeIconsTexture()))
+
+    for data in (b'', b'\x00', b'ab', b'abc', b'abcabcabcabc', bytes(18), bytes(range(256)) * 3):
+        corpus.append(('tiny[%d]' % len(data), data))
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            corpus.append((os.path.basename(path), f.read()))
+
+    return corpus
+
+
+def Check(name, data):
+    """Checks one input, printing what differs, and returns whether it
+    all matched"""
+    start = time.perf_counter()
+    compressed = nsmblib.compress11LZS(data)
+    reference = lz77.LZS11().Compress11LZS(data, reference=True)
+
+    problems = []
+    if compressed != reference:
+        problems.append('compress11LZS gave %d bytes, Compress11LZS %d' % (len(compressed), len(reference)))
+    if nsmblib.decompress11LZS(compressed) != data:
+        problems.append('decompress11LZS did not round-trip')
+    if bytes(lz77.LZS11().Decompress11LZS(compressed)) != data:
+        problems.append('Decompress11LZS did not round-trip')
+
+    print('%-22s %8d %8d %8.1fs  %s' % (name, len(data), len(compressed),
+        time.perf_counter() - start, '; '.join(problems) or 'ok'))
+    return not problems
+
+
+def main():
+    print('%-22s %8s %8s %9s' % ('input', 'size', 'packed', 'time'))
+    passed = True
+    for name, data in Corpus(sys.argv[1:]):
+        passed = Check(name, data) and passed
+
+    if not passed:
+        sys.exit(1)
+    print('\nnsmblib matches lz77 on every input')
+
+
+if __name__ == '__main__': main()
@@ -1,13 +1,12 @@
-from distutils.core import setup
-from distutils.extension import Extension
+from setuptools import setup, Extension
 
 setup(
   name='nsmblib',
-  version='0.5',
+  version='0.6',
   ext_modules=[
     Extension(
       'nsmblib',
-      ['nsmblibmodule.c', 'list.c'],
+      ['nsmblibmodule.c'],
     )
   ]
 )
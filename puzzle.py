@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
 import archive
+import argparse
+import array
+import hashlib
 import lz77
+import multiprocessing
+import os
 import os.path
 import struct
 import sys
+import texlayout
 import time # FIXME: this is temporary
 
 from ctypes import create_string_buffer
@@ -18,6 +24,12 @@ try:
 except ImportError:
     HaveNSMBLib = False
 
+try:
+    import numpy
+    HaveNumPy = True
+except ImportError:
+    HaveNumPy = False
+
 
 ########################################################
 # To Do:
@@ -36,6 +48,8 @@ except ImportError:
 
 Tileset = None
 HexFont = None
+Settings = None
+CompressionLevel = lz77.DefaultCompressionLevel
 
 #############################################################################################
 ########################## Tileset Class and Tile/Object Subclasses #########################
@@ -81,10 +95,27 @@ class TilesetClass():
         self.objects = []
         
         self.slot = 1
+        
+        # compressed texture as loaded or last saved, and the pixelHash it
+        # was made from; saves reuse it while the tiles still match. The
+        # uncompressed texture and checkpoints (see lz77.Recompress11LZS)
+        # are filled in when known, so edits only recompress from the
+        # first changed byte. textureLevel is the compression level it was
+        # made with, or None if it came from a file.
+        self.texture = None
+        self.textureHash = None
+        self.textureData = None
+        self.textureCheckpoints = None
+        self.textureLevel = None
+
+        # decoded texture the tiles were cut from, if their no-alpha images
+        # haven't been made yet; see makeNoAlpha
+        self.image = None
 
 
     def addTile(self, image, noalpha, bytelist = (0, 0, 0, 0, 0, 0, 0, 0)):
-        """Adds an tile class to the tile list with the passed image or parameters"""
+        """Adds an tile class to the tile list with the passed image or parameters.
+        noalpha can be None if it'll be made later by makeNoAlpha."""
 
         self.tiles.append(self.Tile(image, noalpha, bytelist))
         
@@ -111,6 +142,25 @@ class TilesetClass():
         
         self.tiles = []
         self.objects = []
+        self.texture = None
+        self.textureHash = None
+        self.textureData = None
+        self.textureCheckpoints = None
+        self.textureLevel = None
+        self.image = None
+        
+        
+    def makeNoAlpha(self):
+        """Makes the no-alpha images of the tiles that don't have one yet,
+        from an opaque copy of the texture they were decoded from. Only
+        needed once alpha is turned off."""
+        
+        if self.image is None: return
+        noalpha = QtGui.QPixmap.fromImage(self.image.convertToFormat(QtGui.QImage.Format_RGB32))
+        for i, tile in enumerate(self.tiles):
+            if tile.noalpha is None:
+                tile.noalpha = noalpha.copy((i % 32) * 32 + 4, (i // 32) * 32 + 4, 24, 24)
+        self.image = None
         
         
     def clearObjects(self):
@@ -119,6 +169,29 @@ class TilesetClass():
         self.objects = []
         
         
+    def pixelHash(self):
+        """Returns a hash of the pixels of every tile, which only changes
+        when the texture would"""
+        
+        hash = hashlib.sha1()
+        for tile in self.tiles:
+            image = tile.image.toImage().convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+            hash.update(image.constBits().asstring(image.byteCount()))
+        return hash.digest()
+        
+        
+    def setTexture(self, texture, data=None, checkpoints=None, level=None):
+        """Remembers the compressed texture for the current tile pixels,
+        along with the uncompressed texture, its checkpoints and the
+        compression level if known"""
+        
+        self.texture = texture
+        self.textureHash = self.pixelHash()
+        self.textureData = data
+        self.textureCheckpoints = checkpoints
+        self.textureLevel = level
+        
+        
     def clearCollisions(self):
         """Clears the collisions data"""
         
@@ -133,6 +206,69 @@ class TilesetClass():
             tile.byte7 = 0
 
 
+class TextureCompressor(QtCore.QThread):
+    """Compresses a texture on a worker thread at one of the
+    lz77.CompressionLevels, reporting progress through the progress signal.
+    texture, data and checkpoints describe the last compressed texture (any
+    may be None), so only the changed part needs recompressing. Afterwards,
+    result holds the compressed texture, or None if it was cancelled or
+    failed; error holds the exception it failed with, if any."""
+    progress = QtCore.pyqtSignal(int, int)
+
+    def __init__(self, dest, level, texture=None, data=None, checkpoints=None):
+        super().__init__()
+        self.dest = dest
+        self.level = level
+        self.texture = texture
+        self.data = data
+        self.checkpoints = checkpoints
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+        self.lz = lz77.LZS11()
+        self.lz.SetProgressCallback(self.progress.emit)
+
+
+    def run(self):
+        try:
+            self.result = self.compress()
+        except lz77.CompressionCancelled:
+            self.result = None
+        except Exception as e:
+            # there is no one to tell on this thread, so leave it for
+            # whoever started the compression
+            self.error = e
+            self.result = None
+
+        if self.cancelled: self.result = None
+
+
+    def compress(self):
+        lz = self.lz
+        processes = os.cpu_count() or 1
+        # smaller segments than usual, so the progress bar moves more often
+        segmentSize = 0x8000
+        if self.texture is None:
+            result = lz.Compress11LZS(self.dest, processes=processes, segmentSize=segmentSize, level=self.level)
+        else:
+            # only recompress from the first changed byte
+            if self.data is None:
+                self.data = lz.Decompress11LZS(self.texture)
+                self.checkpoints = lz77.FindCheckpoints(self.texture)
+            result = lz.Recompress11LZS(self.dest, self.data, self.texture, self.checkpoints,
+                processes=processes, segmentSize=segmentSize, level=self.level)
+
+        self.checkpoints = lz.checkpoints
+        return result
+
+
+    def cancel(self):
+        """Stops compressing at the next progress update"""
+        self.cancelled = True
+        self.lz.Cancel()
+
+
 #############################################################################################
 ######################### Palette for painting behaviors to tiles ##########################
 
@@ -1351,6 +1487,12 @@ class displayWidget(QtWidgets.QListView):
                     pass
                                 
 
+            # Compression cost heatmap: the redder, the more bytes
+            if window.tileCosts is not None:
+                cost = window.tileCosts[index.row()] / window.tileCostMax
+                painter.fillRect(option.rect, QtGui.QColor(255, 0, 0, int(180 * cost)))
+
+
             # Highlight stuff. 
             color = QtGui.QColor(option.palette.highlight())
             color.setAlpha(80)
@@ -2267,85 +2409,322 @@ class PiecesModel(QtCore.QAbstractListModel):
 ###################### Python-based RGB4A3 decoding code from BRFNTify ######################
 
 
-def RGB4A3Decode(tex, useAlpha=True):
-    dest = QtGui.QImage(1024,256,QtGui.QImage.Format_ARGB32)
-    dest.fill(Qt.transparent)
+def RGB4A3Tables():
+    """Returns the tables that scale 5-, 4- and 3-bit channels up to 8 bits"""
+    five = [int(i * 255 / 0x1F) for i in range(0x20)]
+    four = [int(i * 255 / 0xF) for i in range(0x10)]
+    three = [int(i * 255 / 0x7) for i in range(0x8)]
+    return five, four, three
+
+
+# Tables mapping each of the 65536 texel values straight to its ARGB32 pixel,
+# keyed by useAlpha. RGB4A3LUT builds them on first use; if RGB4A3LUTCache is
+# set, they're loaded from and saved to that file instead.
+RGB4A3LUTs = {}
+RGB4A3LUTCache = None
+
+# A cache file is only used if it starts with this. Bump RGB4A3LUTVersion
+# whenever BuildRGB4A3LUTs computes anything differently (such as if the
+# red/blue swap it keeps is ever fixed), so old caches stop being loaded;
+# changes to RGB4A3Tables are caught by the hash.
+RGB4A3LUTVersion = 1
+RGB4A3LUTMagic = (b'RGB4A3'
+    + (b'LE' if sys.byteorder == 'little' else b'BE')
+    + struct.pack('>H', RGB4A3LUTVersion)
+    + hashlib.sha1(repr(RGB4A3Tables()).encode('ascii')).digest()[:8])
+
+def RGB4A3LUT(useAlpha=True):
+    """Returns the texel -> ARGB32 table for alpha or no-alpha output, as
+    an array('I') that NumPy can also use in place"""
+    if not RGB4A3LUTs:
+        luts = LoadRGB4A3LUTs(RGB4A3LUTCache)
+        if luts is None:
+            luts = BuildRGB4A3LUTs()
+            SaveRGB4A3LUTs(RGB4A3LUTCache, luts)
+        RGB4A3LUTs.update(luts)
+    return RGB4A3LUTs[useAlpha]
+
+
+def BuildRGB4A3LUTs():
+    """Computes the alpha and no-alpha texel -> ARGB32 tables"""
+    five, four, three = RGB4A3Tables()
+    lut = array.array('I', bytes(0x10000 * array.array('I').itemsize))
+
+    for texel in range(0x8000): # RGB4A3
+        # bits 8-11 come out as blue and 0-3 as red, as they always have
+        lut[texel] = ((three[texel >> 12] << 24)
+            | (four[texel & 0xF] << 16)
+            | (four[(texel >> 4) & 0xF] << 8)
+            | four[(texel >> 8) & 0xF])
+
+    for texel in range(0x8000, 0x10000): # RGB555
+        lut[texel] = (0xFF000000
+            | (five[(texel >> 10) & 0x1F] << 16)
+            | (five[(texel >> 5) & 0x1F] << 8)
+            | five[texel & 0x1F])
+
+    noalpha = array.array('I', [pixel | 0xFF000000 for pixel in lut])
+    return {True: lut, False: noalpha}
+
+
+def LoadRGB4A3LUTs(path):
+    """Loads the tables saved by SaveRGB4A3LUTs, or returns None if there
+    aren't any, or they were made by a different version of
+    BuildRGB4A3LUTs or on a machine with the other byte order"""
+    if path is None: return None
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    itemsize = array.array('I').itemsize
+    if len(data) != len(RGB4A3LUTMagic) + 0x20000 * itemsize or not data.startswith(RGB4A3LUTMagic):
+        return None
+
+    luts = {}
+    offset = len(RGB4A3LUTMagic)
+    for useAlpha in (True, False):
+        luts[useAlpha] = array.array('I', data[offset:offset + 0x10000 * itemsize])
+        offset += 0x10000 * itemsize
+    return luts
+
+
+def SaveRGB4A3LUTs(path, luts):
+    """Saves the tables to a cache file, if there's one. Failing to is
+    harmless; they just get built again next time."""
+    if path is None: return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(RGB4A3LUTMagic)
+            f.write(luts[True].tobytes())
+            f.write(luts[False].tobytes())
+    except OSError:
+        pass
+
+
+class TextureDecodeContext(lz77.DecodeContext):
+    """lz77.DecodeContext that also keeps the images and scratch arrays
+    used by RGB4A3Decode, so a batch of textures can be decompressed and decoded without
+    allocating anything new for each one. An image returned when decoding
+    with it is overwritten by the next texture decoded, so copy it to keep
+    it."""
+    def __init__(self):
+        super().__init__()
+        self.images = {}
+        self.scratch = None
+
+    def Image(self, useAlpha):
+        """Returns the reusable 1024x256 image for alpha or no-alpha output"""
+        image = self.images.get(useAlpha)
+        if image is None:
+            image = QtGui.QImage(1024,256,QtGui.QImage.Format_ARGB32)
+            self.images[useAlpha] = image
+        return image
+
+    def Scratch(self):
+        """Returns the reusable NumPy arrays RGB4A3DecodeNumPy gathers a
+        texture's texels into: one in the texture's own big-endian format,
+        and one of indices into the lookup table"""
+        if self.scratch is None:
+            self.scratch = (numpy.empty(262144, '>u2'), numpy.empty(262144, numpy.intp))
+        return self.scratch
+
+
+
+def ImagePixels(image, writable=False):
+    """Returns the pixels of a 32-bit image as a memoryview of unsigned
+    ints, indexed by y * width + x, without copying them. Only works for
+    images with no padding at the ends of rows."""
+    bits = image.bits() if writable else image.constBits()
+    bits.setsize(image.byteCount())
+    return memoryview(bits).cast('I')
+
+
+def RGB4A3Decode(tex, useAlpha=True, context=None):
+    """Decodes an RGB4A3 texture into a 1024x256 image. With a
+    TextureDecodeContext, its reusable image is decoded into and returned."""
+    if HaveNumPy:
+        return RGB4A3DecodeNumPy(tex, useAlpha, context)
+
+    if context is None:
+        dest = QtGui.QImage(1024,256,QtGui.QImage.Format_ARGB32)
+    else:
+        dest = context.Image(useAlpha)
+    lut = RGB4A3LUT(useAlpha)
     
-    i = 0
     for ytile in range(0, 256, 4):
-        for xtile in range(0, 1024, 4):
-            for ypixel in range(ytile, ytile + 4):
-                for xpixel in range(xtile, xtile + 4):
-                    
-                    if(xpixel >= 1024 or ypixel >= 256):
-                        continue
-                    
-                    newpixel = (tex[i] << 8) | tex[i+1]
-                    
-    
-                    if(newpixel >= 0x8000): # Check if it's RGB555
-                        red = ((newpixel >> 10) & 0x1F) * 255 / 0x1F
-                        green = ((newpixel >> 5) & 0x1F) * 255 / 0x1F
-                        blue = (newpixel & 0x1F) * 255 / 0x1F
-                        alpha = 0xFF
-    
-                    else: # If not, it's RGB4A3
-                        alpha = ((newpixel & 0x7000) >> 12) * 255 / 0x7
-                        blue = ((newpixel & 0xF00) >> 8) * 255 / 0xF
-                        green = ((newpixel & 0xF0) >> 4) * 255 / 0xF
-                        red = (newpixel & 0xF) * 255 / 0xF
-
-                    alpha, red, green, blue = int(alpha), int(red), int(green), int(blue)
-                    if not useAlpha: alpha = 0xFF
+        RGB4A3DecodeRow(dest, tex, ytile * 2048, ytile, useAlpha, lut)
+    return dest
+
+
+def RGB4A3DecodeRow(dest, tex, i, ytile, useAlpha=True, lut=None):
+    """Decodes one row of 4x4 blocks (8192 bytes of tex, starting at i)
+    into pixel rows ytile to ytile + 3 of dest. lut is from RGB4A3LUT."""
+    lut = lut or RGB4A3LUT(useAlpha)
+    pixels = ImagePixels(dest, True)
+    start = ytile * 1024
+    order = texlayout.BlockOrder(1024, 256)[start:start + 4096]
+
+    for pixel, texel in zip(order, struct.unpack_from('>4096H', tex, i)):
+        pixels[pixel] = lut[texel]
+
+
+def RGB4A3DecodeStream(chunks):
+    """Decodes a texture handed over as an iterable of chunks (such as
+    lz77.IterDecompress11LZS yields), decoding each row of 4x4 blocks as
+    soon as it is complete. Returns the alpha image; Tileset.makeNoAlpha
+    makes the no-alpha one from it when needed."""
+    dest = QtGui.QImage(1024,256,QtGui.QImage.Format_ARGB32)
+    dest.fill(Qt.transparent)
+    lut = RGB4A3LUT(True)
     
-                    argb = (blue) | (green << 8) | (red << 16) | (alpha << 24)
-                    dest.setPixel(xpixel, ypixel, argb)
-                    i += 2
+    row = b''
+    ytile = 0
+    for chunk in chunks:
+        row += chunk
+        while len(row) >= 8192 and ytile < 256:
+            RGB4A3DecodeRow(dest, row, 0, ytile, True, lut)
+            row = row[8192:]
+            ytile += 4
+    return dest
+
+
+def RGB4A3DecodeNumPy(tex, useAlpha=True, context=None):
+    """RGB4A3Decode, vectorized with NumPy. The pixels are written straight
+    into the image's own buffer, so Qt keeps owning it."""
+    if context is None:
+        dest = QtGui.QImage(1024,256,QtGui.QImage.Format_ARGB32)
+        texels = numpy.empty(262144, '>u2')
+        indices = numpy.empty(262144, numpy.intp)
+    else:
+        dest = context.Image(useAlpha)
+        texels, indices = context.Scratch()
+    lut = numpy.frombuffer(RGB4A3LUT(useAlpha), numpy.uint32)
+
+    texlayout.Unswizzle(numpy.frombuffer(tex, '>u2', 262144), 1024, 256, out=texels)
+
+    # take would convert indices of any other type into a new array, and
+    # the 'clip' mode (a no-op here) keeps it from buffering its output
+    indices[...] = texels
+    pixels = numpy.frombuffer(ImagePixels(dest, True), numpy.uint32)
+    numpy.take(lut, indices, out=pixels, mode='clip')
     return dest
 
 
-def RGB4A3Encode(tex):
+def RGB4A3Encode(tex, canonical=False, snapBits=0):
+    """Encodes a 1024x256 QImage as an RGB4A3 texture.
+    With canonical, every fully transparent pixel is stored as 0x0000,
+    whatever colour was under it, so transparent areas turn into long LZ
+    matches. With snapBits, a 4x4 block that only differs from one of the
+    last 128 blocks (as far back as an LZ11 match reaches) in the lowest
+    snapBits bits of each colour channel is replaced by that block, so it
+    becomes a single match. That one is lossy."""
+    if HaveNumPy:
+        return RGB4A3EncodeNumPy(tex, canonical, snapBits)
+
+    if tex.format() != QtGui.QImage.Format_ARGB32:
+        tex = tex.convertToFormat(QtGui.QImage.Format_ARGB32)
+    pixels = ImagePixels(tex)
+    order = texlayout.BlockOrder(1024, 256)
+
     destBuffer = create_string_buffer(524288)
 
-    shortstruct = struct.Struct('>H')
-    offset = 0
+    blockstruct = struct.Struct('>16H')
 
-    for ytile in range(0, 256, 4):
-        for xtile in range(0, 1024, 4):
-            for ypixel in range(ytile, ytile + 4):
-                for xpixel in range(xtile, xtile + 4):
-                    
-                    if(xpixel >= 1024 or ypixel >= 256):
-                        continue
-                    
-                    pixel = tex.pixel(xpixel, ypixel)
-                    
-                    a = pixel >> 24
-                    r = (pixel >> 16) & 0xFF
-                    g = (pixel >> 8) & 0xFF
-                    b = pixel & 0xFF
-                    
-                    if a < 245: # RGB4A3
-                        alpha = a/32
-                        red = r/16
-                        green = g/16
-                        blue = b/16
+    # what each pixel is compared on when snapping
+    snapMasks = {
+        0: 0x7000 | (((0xF << snapBits) & 0xF) * 0x111),
+        0x8000: 0x8000 | (((0x1F << snapBits) & 0x1F) * 0x421),
+        }
+    recentBlocks = {}
+    block = 0
 
-                        rgbDAT = (blue) | (green << 4) | (red << 8) | (alpha << 12)
+    for offset in range(0, 524288, 32):
+        values = []
+        for index in order[offset // 2:offset // 2 + 16]:
+            
+            pixel = pixels[index]
+            
+            a = pixel >> 24
+            r = (pixel >> 16) & 0xFF
+            g = (pixel >> 8) & 0xFF
+            b = pixel & 0xFF
+            
+            if a < 245: # RGB4A3
+                alpha = a//32
+                red = r//16
+                green = g//16
+                blue = b//16
+
+                if canonical and alpha == 0:
+                    rgbDAT = 0
+                else:
+                    rgbDAT = (blue) | (green << 4) | (red << 8) | (alpha << 12)
+        
+            else: # RGB555
+                red = r//8
+                green = g//8
+                blue = b//8
+                
+                rgbDAT = (blue) | (green << 5) | (red << 10) | (0x8000) # 0rrrrrgggggbbbbb
+                                                                                                    
+            values.append(rgbDAT)
+
+        if snapBits:
+            key = tuple([value & snapMasks[value & 0x8000] for value in values])
+            recent = recentBlocks.get(key)
+            if recent is not None and block - recent[0] <= 128:
+                values = recent[1]
+            recentBlocks[key] = (block, values)
+            block += 1
+
+        blockstruct.pack_into(destBuffer, offset, *values)
                 
-                    else: # RGB555
-                        red = r/8
-                        green = g/8
-                        blue = b/8
-                        
-                        rgbDAT = (blue) | (green << 5) | (red << 10) | (0x8000) # 0rrrrrgggggbbbbb
-                                                                                                            
-                    shortstruct.pack_into(destBuffer, offset, rgbDAT)
-                    offset += 2
-                    
     return destBuffer.raw
 
 
+def RGB4A3EncodeNumPy(tex, canonical=False, snapBits=0):
+    """RGB4A3Encode, vectorized with NumPy. Reads the image's pixel buffer
+    in place instead of calling pixel() for each pixel."""
+    if tex.format() != QtGui.QImage.Format_ARGB32:
+        tex = tex.convertToFormat(QtGui.QImage.Format_ARGB32)
+
+    bits = tex.constBits()
+    bits.setsize(tex.byteCount())
+    pixels = numpy.frombuffer(bits, numpy.uint32).reshape(256, tex.bytesPerLine() // 4)[:, :1024]
+
+    a = pixels >> 24
+    r = (pixels >> 16) & 0xFF
+    g = (pixels >> 8) & 0xFF
+    b = pixels & 0xFF
+
+    rgb4a3 = (b >> 4) | ((g >> 4) << 4) | ((r >> 4) << 8) | ((a >> 5) << 12)
+    if canonical:
+        rgb4a3[a < 32] = 0
+    rgb555 = (b >> 3) | ((g >> 3) << 5) | ((r >> 3) << 10) | 0x8000
+    values = numpy.where(a < 245, rgb4a3, rgb555)
+
+    blocks = texlayout.Swizzle(values, 1024, 256).reshape(16384, 16).astype('>u2')
+
+    if snapBits:
+        # what each pixel is compared on when snapping
+        masks = numpy.where(blocks & 0x8000,
+            0x8000 | (((0x1F << snapBits) & 0x1F) * 0x421),
+            0x7000 | (((0xF << snapBits) & 0xF) * 0x111)).astype('>u2')
+        keys = blocks & masks
+        recentBlocks = {}
+        for block in range(16384):
+            key = keys[block].tobytes()
+            recent = recentBlocks.get(key)
+            if recent is not None and block - recent <= 128:
+                blocks[block] = blocks[recent]
+            recentBlocks[key] = block
+
+    return blocks.tobytes()
+
+
 #############################################################################################
 ############ Main Window Class. Takes care of menu functions and widget creation ############
 
@@ -2357,6 +2736,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tileImage = QtGui.QPixmap()
         self.collision = False
         self.alpha = True
+        self.tileCosts = None
         
         global Tileset
         Tileset = TilesetClass()
@@ -2445,22 +2825,19 @@ class MainWindow(QtWidgets.QMainWindow):
                 )
             return
         
-        # Stolen from Reggie! Loads the Image Data.
+        # Stolen from Reggie! Loads the Image Data. Only the alpha image is
+        # decoded; the no-alpha one is made from it if alpha is turned off.
         if HaveNSMBLib:
             tiledata = nsmblib.decompress11LZS(Image)
             argbdata = nsmblib.decodeTileset(tiledata)
             #rgbdata = nsmblib.decodeTilesetNoAlpha(tiledata)
-            rgbdata = nsmblib.decodeTileset(tiledata)
             dest = QtGui.QImage(argbdata, 1024, 256, 4096, QtGui.QImage.Format_ARGB32_Premultiplied)
-            noalphadest = QtGui.QImage(rgbdata, 1024, 256, 4096, QtGui.QImage.Format_ARGB32_Premultiplied)
+        elif HaveNumPy:
+            dest = RGB4A3Decode(lz77.LZS11().Decompress11LZS(Image))
         else:
-            lz = lz77.LZS11()
-            decomp = lz.Decompress11LZS(Image)
-            dest = RGB4A3Decode(decomp)
-            noalphadest = RGB4A3Decode(decomp, False)
+            dest = RGB4A3DecodeStream(lz77.IterDecompress11LZS(Image))
         
         self.tileImage = QtGui.QPixmap.fromImage(dest)
-        noalpha = QtGui.QPixmap.fromImage(noalphadest)
         
         # Loads Tile behaviors
                     
@@ -2473,12 +2850,23 @@ class MainWindow(QtWidgets.QMainWindow):
         Xoffset = 4
         Yoffset = 4
         for i in range(256):
-            Tileset.addTile(self.tileImage.copy(Xoffset,Yoffset,24,24), noalpha.copy(Xoffset,Yoffset,24,24), behaviors[i])
+            tile = self.tileImage.copy(Xoffset,Yoffset,24,24)
+            if HaveNSMBLib:
+                # nsmblib's image is premultiplied, so the colour under
+                # transparent pixels is gone; use the alpha tile for both
+                Tileset.addTile(tile, tile, behaviors[i])
+            else:
+                Tileset.addTile(tile, None, behaviors[i])
             Xoffset += 32
             if Xoffset >= 1024:
                 Xoffset = 4
                 Yoffset += 32                    
         
+        Tileset.setTexture(Image)
+        if not HaveNSMBLib:
+            Tileset.image = dest
+            if not self.alpha: Tileset.makeNoAlpha()
+        
         
         # Load Objects
         
@@ -2617,6 +3005,7 @@ class MainWindow(QtWidgets.QMainWindow):
             
         
         outdata = self.saving(self.internalname)
+        if outdata is None: return
         
         fn = self.name
         f = open(fn, 'wb')
@@ -2630,10 +3019,12 @@ class MainWindow(QtWidgets.QMainWindow):
             '.arc (*.arc)')[0]
         if not fn: return
 
+        outdata = self.saving(self.internalname)
+        if outdata is None: return
+
         self.name = fn
         self.setWindowTitle('Puzzle Next - ' + os.path.basename(str(fn)))
         
-        outdata = self.saving(self.internalname)
         f = open(fn, 'wb')
         f.write(outdata)
         f.close()
@@ -2644,6 +3035,9 @@ class MainWindow(QtWidgets.QMainWindow):
         # Prepare tiles, objects, object metadata, and textures and stuff into buffers.
 
         textureBuffer = self.PackTexture()
+        if textureBuffer is None: return None
+        if self.tileCosts is not None:
+            self.updateTileCosts(textureBuffer)
         tileBuffer = self.PackTiles()
         objectBuffers = self.PackObjects()
         objectBuffer = objectBuffers[0]
@@ -2667,6 +3061,14 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def PackTexture(self):
 
+        # A texture loaded from a file is good at any level, but one we
+        # compressed ourselves is only reused at the same level
+        reusable = Tileset.texture is not None and Tileset.textureLevel in (None, CompressionLevel)
+
+        # Nothing visual changed since the texture was loaded or last saved
+        if reusable and Tileset.pixelHash() == Tileset.textureHash:
+            return Tileset.texture
+
         tex = QtGui.QImage(1024, 256, QtGui.QImage.Format_ARGB32)
         tex.fill(Qt.transparent)
         painter = QtGui.QPainter(tex)
@@ -2740,32 +3142,43 @@ class MainWindow(QtWidgets.QMainWindow):
                                     
         painter.end()
 
-        dest = RGB4A3Encode(tex)
+        # transparent pixels all become 0x0000, whatever colour they had
+        dest = RGB4A3Encode(tex, canonical=True)
         
         
-        items = ('Very Slow Compression, Good Quality', 'Fast Compression, but the Image gets damaged')
-
-        item, ok = QtWidgets.QInputDialog.getItem(self, 'Choose compression method',
-                'Two methods of compression are available. Choose \n'
-                'fast compression for rapid testing. Choose slow \n'
-                'compression for releases. Bug Treeki to get the fast \n'
-                'compression fixed!', items, 0, False)
-        if ok and item == 'Very Slow Compression, Good Quality':
-            lz = lz77.LZS11()
-
-            progress = QtWidgets.QProgressDialog(self)
-            progress.setCancelButton(None)
-            progress.setMinimumDuration(0)
-            progress.setWindowModality(Qt.WindowModal)
-            progress.setWindowTitle('Puzzle')
-            lz.SetProgressBar(progress)
-            
-            TexBuffer = (lz.Compress11LZS(dest))
-            progress.setValue(progress.maximum()) # autodeletes it
+        # Compress on a worker thread, so the window keeps redrawing and
+        # the save can be cancelled
+        if reusable:
+            compressor = TextureCompressor(dest, CompressionLevel, Tileset.texture, Tileset.textureData, Tileset.textureCheckpoints)
         else:
-            TexBuffer = nsmblib.compress11LZS(dest)
+            compressor = TextureCompressor(dest, CompressionLevel)
+
+        progress = QtWidgets.QProgressDialog('Compressing...', 'Cancel', 0, 0, self)
+        progress.setMinimumDuration(0)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setWindowTitle('Puzzle')
+
+        def updateProgress(current, total):
+            progress.setLabelText('Compressing: ('+str(current)+' / '+str(total)+')')
+            progress.setRange(0, total)
+            progress.setValue(current)
+
+        loop = QtCore.QEventLoop()
+        compressor.progress.connect(updateProgress)
+        compressor.finished.connect(loop.quit)
+        progress.canceled.connect(compressor.cancel)
+        compressor.start()
+        loop.exec_()
+        progress.close()
+        
+        if compressor.error is not None:
+            QtWidgets.QMessageBox.warning(self, 'Error',
+                'The texture could not be compressed:\n\n{0}: {1}'.format(type(compressor.error).__name__, compressor.error))
+            return None
+        if compressor.result is None: return None # cancelled
         
-        return TexBuffer
+        Tileset.setTexture(compressor.result, dest, compressor.checkpoints, CompressionLevel)
+        return compressor.result
 
 
     def PackTiles(self):
@@ -2897,12 +3310,35 @@ class MainWindow(QtWidgets.QMainWindow):
         a.setCheckable(True)
         a.setChecked(True)
         a.toggled.connect(self.toggleAlpha)
+        a = viewMenu.addAction('Overlay Compression Cost', lambda: None, QtGui.QKeySequence('Ctrl+Shift+C'))
+        a.setCheckable(True)
+        a.toggled.connect(self.costOverlay)
+        self.costAction = a
 
         taskMenu = self.menuBar().addMenu('&Tasks')
         #taskMenu.addAction('Set Tileset Slot...', self.setSlot, QtGui.QKeySequence('Ctrl+T'))
         taskMenu.addAction('Clear Collision Data', Tileset.clearCollisions, QtGui.QKeySequence('Ctrl+Shift+Backspace'))
         taskMenu.addAction('Clear Object Data', Tileset.clearObjects, QtGui.QKeySequence('Ctrl+Alt+Backspace'))
 
+        levelMenu = taskMenu.addMenu('Compression Level')
+        levelGroup = QtWidgets.QActionGroup(self)
+        for level in lz77.CompressionLevels:
+            a = levelMenu.addAction(level.capitalize())
+            a.setCheckable(True)
+            a.setChecked(level == CompressionLevel)
+            a.triggered.connect(lambda checked, level=level: self.setCompressionLevel(level))
+            levelGroup.addAction(a)
+
+
+    def setCompressionLevel(self, level):
+        """
+        Sets the compression level used for saving, and remembers it
+        """
+        global CompressionLevel
+        CompressionLevel = level
+        if Settings is not None:
+            Settings.setValue('CompressionLevel', level)
+
 
     def setSlot(self, slotNum):
         """
@@ -2937,11 +3373,35 @@ class MainWindow(QtWidgets.QMainWindow):
         self.updateInfo(0, 0)
 
 
+    def costOverlay(self, enabled):
+        """
+        Compression cost overlay clicked
+        """
+        self.tileCosts = None
+        if enabled:
+            texture = self.PackTexture()
+            if texture is None:
+                self.costAction.setChecked(False)
+                return
+            self.updateTileCosts(texture)
+        self.tileDisplay.viewport().update()
+
+
+    def updateTileCosts(self, texture):
+        """
+        Works out how many compressed bytes each tile takes up in texture,
+        for the compression cost overlay
+        """
+        self.tileCosts = lz77.TileCosts11LZS(lz77.Analyze11LZS(texture))
+        self.tileCostMax = max(self.tileCosts) or 1
+
+
     def toggleAlpha(self, enabled):
         """
         Replace Alpha Image with non-Alpha images in model
         """
         self.alpha = enabled
+        if not enabled: Tileset.makeNoAlpha()
 
         self.setuptile()
         
@@ -3056,9 +3516,27 @@ def main():
     """
     Main function
     """
-    global app, HexFont, window
-
-    app = QtWidgets.QApplication(sys.argv)
+    global app, HexFont, window, Settings, CompressionLevel, RGB4A3LUTCache
+
+    # lz77 compresses in worker processes, which frozen builds need this for
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description='Puzzle Next - NSMBW Tileset Editor')
+    parser.add_argument('--compression-level', choices=list(lz77.CompressionLevels),
+        help='texture compression level for this session (default: the last one picked in the Tasks menu)')
+    args, qtargs = parser.parse_known_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qtargs)
+
+    Settings = QtCore.QSettings('Puzzle', 'Puzzle Next')
+    RGB4A3LUTCache = os.path.join(QtCore.QStandardPaths.writableLocation(
+        QtCore.QStandardPaths.CacheLocation), 'rgb4a3.lut')
+    if args.compression_level is not None:
+        CompressionLevel = args.compression_level
+    else:
+        CompressionLevel = str(Settings.value('CompressionLevel', lz77.DefaultCompressionLevel))
+        if CompressionLevel not in lz77.CompressionLevels:
+            CompressionLevel = lz77.DefaultCompressionLevel
 
     HexFont = QtGui.QFont('"Courier New", Courier, monospace')
     HexFont.setPointSize(12)
@@ -0,0 +1,122 @@
+"""Checks that lz77's Recompress11LZS gives exactly what compressing from
+scratch does.
+
+For each texture and compression level (except squeeze, and maximum, whose
+optimal parser isn't covered by that promise), compresses a slice of the
+texture, then edits one byte at and around every checkpoint the compressor
+recorded (where resuming is most likely to go wrong), plus some random
+places. The balanced level is also run on two worker processes with small
+segments, adding edits around the segment boundaries. Each byte is changed a few ways, including to values that extend
+the match running into it. Each edited copy is recompressed with
+Recompress11LZS and compared with what Compress11LZS makes of it. The
+corpus is the synthetic and Icons textures from texcorpus, and any
+uncompressed texture files given.
+
+    python recompress_check.py [--size 65536] [--random 8] [--segment-size 16384] [textures]
+
+The exit status is 1 if any edit gives a different stream. Without a
+display, run it with QT_QPA_PLATFORM=offscreen.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from PyQt5 import QtWidgets
+
+import lz77
+import texcorpus
+
+
+# (level, worker processes)
+Configs = (('store', 1), ('fast', 1), ('balanced', 1), ('balanced', 2))
+
+
+def Edits(points, size, count, rand):
+    """Returns the offsets to change: around every one of points, and
+    count random ones"""
+    edits = set()
+    for src in points:
+        for offset in range(src - 2, src + 3):
+            if 0 <= offset < size:
+                edits.add(offset)
+    for i in range(count):
+        edits.add(rand.randrange(size))
+    return sorted(edits)
+
+
+def Replacements(data, offset):
+    """Returns the values to try in place of data[offset]: its inverse, and
+    copies of the bytes an earlier match would continue with"""
+    values = {data[offset] ^ 0xFF, 0}
+    for distance in (1, 2, 32):
+        if offset >= distance:
+            values.add(data[offset - distance])
+    values.discard(data[offset])
+    return sorted(values)
+
+
+def Check(name, data, level, randomEdits, processes=1, segmentSize=0x10000):
+    """Tries every edit on data at one level, printing the ones that
+    differ, and returns how many there were"""
+    rand = random.Random(0)
+    settings = dict(level=level, processes=processes, segmentSize=segmentSize)
+    compressor = lz77.LZS11()
+    compressed = compressor.Compress11LZS(data, **settings)
+    checkpoints = compressor.checkpoints
+
+    points = [src for src, dest in checkpoints]
+    if processes > 1:
+        points.extend(range(segmentSize, len(data), segmentSize))
+    label = level if processes == 1 else '%s x%d' % (level, processes)
+
+    tried = 0
+    failures = 0
+    for offset in Edits(points, len(data), randomEdits, rand):
+        for value in Replacements(data, offset):
+            edited = bytearray(data)
+            edited[offset] = value
+            edited = bytes(edited)
+
+            expected = lz77.LZS11().Compress11LZS(edited, **settings)
+            result = lz77.LZS11().Recompress11LZS(edited, data, compressed, checkpoints, **settings)
+            tried += 1
+            if result != expected:
+                print('  %s/%s: 0x%02X at 0x%X gives a different stream' % (name, label, value, offset))
+                failures += 1
+
+    print('%-14s %-12s %4d edits, %d different' % (name, label, tried, failures))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks Recompress11LZS against Compress11LZS')
+    parser.add_argument('textures', nargs='*', help='extra raw RGB4A3 textures')
+    parser.add_argument('--size', type=int, default=0x10000, help='bytes of each texture to use')
+    parser.add_argument('--random', type=int, default=8, help='random edits per texture and level')
+    parser.add_argument('--segment-size', type=int, default=0x4000, help='segment size for the runs on several processes')
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+
+    textures = [
+        ('synthetic', texcorpus.MakeTexture(0)),
+        ('icons', texcorpus.MakeIconsTexture()),
+        ]
+    for path in args.textures:
+        with open(path, 'rb') as f:
+            textures.append((os.path.basename(path), f.read()))
+
+    failures = 0
+    for name, data in textures:
+        for level, processes in Configs:
+            segmentSize = args.segment_size if processes > 1 else 0x10000
+            failures += Check(name, data[:args.size], level, args.random, processes, segmentSize)
+
+    if failures:
+        sys.exit(1)
+    print('\nRecompress11LZS matched every time')
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,62 @@
+"""Textures for the codec benchmarks and the nsmblib parity check, so they
+all run over the same corpus. Every texture is a 1024x256 RGB4A3 tileset
+texture (524288 bytes), uncompressed."""
+
+import glob
+import os
+import random
+import struct
+
+
+def MakeTexture(seed):
+    """Makes a fake RGB4A3 tileset texture: every 32x32 tile gets a small
+    palette, mostly opaque, and the 4x4 blocks are filled from it"""
+    rand = random.Random(seed)
+    blockstruct = struct.Struct('>16H')
+    blocks = []
+
+    palettes = []
+    for tile in range(256):
+        palette = []
+        for i in range(rand.randint(1, 6)):
+            if rand.random() < 0.2:
+                palette.append(rand.getrandbits(15) & 0x7FFF) # RGB4A3
+            else:
+                palette.append(rand.getrandbits(15) | 0x8000) # RGB555
+        palettes.append(palette)
+
+    for ytile in range(0, 256, 4):
+        for xtile in range(0, 1024, 4):
+            palette = palettes[(ytile // 32) * 32 + (xtile // 32)]
+            if rand.random() < 0.3:
+                blocks.append(blockstruct.pack(*([palette[0]] * 16)))
+            else:
+                blocks.append(blockstruct.pack(*[rand.choice(palette) for i in range(16)]))
+
+    return b''.join(blocks)
+
+
+def MakeNoiseTexture(seed):
+    """Makes a texture of random bytes, which hardly compresses at all"""
+    return random.Random(seed).getrandbits(524288 * 8).to_bytes(524288, 'little')
+
+
+def MakeIconsTexture():
+    """Draws the PNGs in Icons/ into the 256 tiles of a texture, the way
+    PackTexture lays tiles out, and encodes it. Needs PyQt5 (and a
+    QApplication, for image loading)."""
+    from PyQt5 import QtCore, QtGui
+    import puzzle
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Icons')
+    icons = sorted(glob.glob(os.path.join(path, '**', '*.png'), recursive=True))
+
+    tex = QtGui.QImage(1024, 256, QtGui.QImage.Format_ARGB32)
+    tex.fill(QtCore.Qt.transparent)
+    painter = QtGui.QPainter(tex)
+    for i in range(256):
+        icon = QtGui.QImage(icons[i % len(icons)]).scaled(24, 24)
+        painter.drawImage((i % 32) * 32 + 4, (i // 32) * 32 + 4, icon)
+    painter.end()
+
+    return puzzle.RGB4A3Encode(tex)
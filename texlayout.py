@@ -0,0 +1,98 @@
+from array import array
+
+try:
+    import numpy
+    HaveNumPy = True
+except ImportError:
+    HaveNumPy = False
+
+# GameCube/Wii textures are stored as a grid of small blocks (4x4 pixels for
+# 16-bit formats like RGB4A3), left to right and then top to bottom, with
+# each block's pixels in row order. Rather than walking that with a loop
+# nest in every codec, the permutation between stream order and pixel
+# order is worked out once per texture shape and reused as a single gather
+# or scatter.
+#
+# Pixel indices are y * width + x. Tables are keyed by
+# (width, height, blockWidth, blockHeight).
+BlockOrders = {}
+PixelOrders = {}
+BlockOrderArrays = {}
+PixelOrderArrays = {}
+
+
+def BlockOrder(width, height, blockWidth=4, blockHeight=4):
+    """Returns, for each texel in stream order, the index of the pixel it
+    holds, as an array('I'). Texel n of block row r is at
+    BlockOrder(...)[r * width * blockHeight + n]."""
+    key = (width, height, blockWidth, blockHeight)
+    order = BlockOrders.get(key)
+    if order is None:
+        assert width % blockWidth == 0 and height % blockHeight == 0, 'Texture is not a whole number of blocks'
+
+        # every row of blocks is the first one, moved down
+        row = []
+        for xblock in range(0, width, blockWidth):
+            for y in range(blockHeight):
+                start = y * width + xblock
+                row.extend(range(start, start + blockWidth))
+
+        order = array('I')
+        for start in range(0, width * height, width * blockHeight):
+            order.extend([pixel + start for pixel in row])
+        BlockOrders[key] = order
+    return order
+
+
+def PixelOrder(width, height, blockWidth=4, blockHeight=4):
+    """Returns, for each pixel, the index of the texel in the stream that
+    holds it, as an array('I'); the inverse of BlockOrder"""
+    key = (width, height, blockWidth, blockHeight)
+    order = PixelOrders.get(key)
+    if order is None:
+        blockOrder = BlockOrder(width, height, blockWidth, blockHeight)
+        order = array('I', bytes(len(blockOrder) * blockOrder.itemsize))
+        for texel, pixel in enumerate(blockOrder):
+            order[pixel] = texel
+        PixelOrders[key] = order
+    return order
+
+
+def BlockOrderArray(width, height, blockWidth=4, blockHeight=4):
+    """BlockOrder as a NumPy index array"""
+    key = (width, height, blockWidth, blockHeight)
+    order = BlockOrderArrays.get(key)
+    if order is None:
+        order = numpy.frombuffer(BlockOrder(*key), numpy.uint32).astype(numpy.intp)
+        BlockOrderArrays[key] = order
+    return order
+
+
+def PixelOrderArray(width, height, blockWidth=4, blockHeight=4):
+    """PixelOrder as a NumPy index array"""
+    key = (width, height, blockWidth, blockHeight)
+    order = PixelOrderArrays.get(key)
+    if order is None:
+        order = numpy.frombuffer(PixelOrder(*key), numpy.uint32).astype(numpy.intp)
+        PixelOrderArrays[key] = order
+    return order
+
+
+def Swizzle(pixels, width, height, blockWidth=4, blockHeight=4):
+    """Reorders a NumPy array of width * height pixels (in any shape) into
+    stream order, returning a flat array"""
+    return pixels.reshape(-1)[BlockOrderArray(width, height, blockWidth, blockHeight)]
+
+
+def Unswizzle(texels, width, height, blockWidth=4, blockHeight=4, out=None):
+    """Reorders a NumPy array of texels in stream order into a height x
+    width array of pixels. Given out (a contiguous array of the same type,
+    in any shape), the pixels are gathered into that instead, and it is
+    returned."""
+    order = PixelOrderArray(width, height, blockWidth, blockHeight)
+    if out is None:
+        return texels.reshape(-1)[order].reshape(height, width)
+    
+    # in the default 'raise' mode, take gathers into a temporary copy of out
+    numpy.take(texels.reshape(-1), order, out=out.reshape(-1), mode='clip')
+    return out
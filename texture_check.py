@@ -0,0 +1,127 @@
+"""Checks that Puzzle's NumPy texture codecs give exactly what the pure
+Python ones do.
+
+Every texture in the corpus is decoded with RGB4A3Decode both ways, with
+and without alpha, and with and without a TextureDecodeContext. Then
+RGB4A3Encode is run both ways, with every combination of canonical and
+snapBits, on the decoded images, on random pixels (every alpha value,
+including the ones the RGB4A3/RGB555 and transparency cut-offs fall
+between), on a premultiplied copy, and on a decoded image with the lowest
+bits of each channel jittered, so that snapBits has near-duplicate blocks
+to snap. The corpus is the textures from texcorpus, and any uncompressed
+texture files given.
+
+    python texture_check.py [textures]
+
+NumPy is needed. The exit status is 1 if anything differs. Without a
+display, run it with QT_QPA_PLATFORM=offscreen.
+"""
+
+import os
+import random
+import sys
+
+import numpy
+from PyQt5 import QtGui, QtWidgets
+
+import puzzle
+import texcorpus
+
+
+def ImageBits(image):
+    """Returns the pixel bytes of an image"""
+    return image.constBits().asstring(image.byteCount())
+
+
+def Both(func):
+    """Runs func with NumPy and then without, and returns both results"""
+    try:
+        puzzle.HaveNumPy = True
+        fast = func()
+        puzzle.HaveNumPy = False
+        slow = func()
+    finally:
+        puzzle.HaveNumPy = True
+    return fast, slow
+
+
+def NumPyImage(pixels):
+    """Returns a new ARGB32 image holding a 256x1024 array of pixels"""
+    image = QtGui.QImage(1024, 256, QtGui.QImage.Format_ARGB32)
+    numpy.frombuffer(puzzle.ImagePixels(image, True), numpy.uint32)[:] = pixels.reshape(-1)
+    return image
+
+
+def CheckDecode(name, tex):
+    """Checks decoding one texture, and returns the images decoded
+    (alpha first) and how many results differed"""
+    failures = 0
+    images = []
+    for useAlpha in (True, False):
+        for context in (None, puzzle.TextureDecodeContext()):
+            fast, slow = Both(lambda: puzzle.RGB4A3Decode(tex, useAlpha, context))
+            if ImageBits(fast) != ImageBits(slow):
+                print('  %s: RGB4A3Decode(useAlpha=%s, context=%s) differs' % (name, useAlpha, context is not None))
+                failures += 1
+        images.append(QtGui.QImage(fast))
+    return images, failures
+
+
+def CheckEncode(name, image):
+    """Checks encoding one image with every setting, and returns how many
+    results differed"""
+    failures = 0
+    for canonical in (False, True):
+        for snapBits in (0, 1, 2, 3):
+            fast, slow = Both(lambda: puzzle.RGB4A3Encode(image, canonical, snapBits))
+            if fast != slow:
+                print('  %s: RGB4A3Encode(canonical=%s, snapBits=%d) differs' % (name, canonical, snapBits))
+                failures += 1
+    return failures
+
+
+def main():
+    if not puzzle.HaveNumPy:
+        sys.exit('NumPy is needed to compare the NumPy codecs with the Python ones')
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+
+    textures = [
+        ('synthetic', texcorpus.MakeTexture(0)),
+        ('icons', texcorpus.MakeIconsTexture()),
+        ('transparent', bytes(524288)),
+        ('noise', texcorpus.MakeNoiseTexture(0)),
+        ]
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            textures.append((os.path.basename(path), f.read()))
+
+    failures = 0
+    images = []
+    for name, tex in textures:
+        (alpha, noAlpha), differing = CheckDecode(name, tex)
+        print('%-14s decode %s' % (name, differing and '%d different' % differing or 'ok'))
+        failures += differing
+        images.append((name, alpha))
+        images.append((name + '/no alpha', noAlpha))
+
+    rand = numpy.random.RandomState(0)
+    images.append(('random', NumPyImage(rand.randint(0, 1 << 32, (256, 1024), numpy.uint64).astype(numpy.uint32))))
+    images.append(('premultiplied', images[-1][1].convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)))
+
+    pixels = numpy.frombuffer(puzzle.ImagePixels(images[0][1]), numpy.uint32).reshape(256, 1024)
+    jitter = rand.randint(0, 8, (256, 1024, 3)).astype(numpy.uint32)
+    jitter = jitter[..., 0] | (jitter[..., 1] << 8) | (jitter[..., 2] << 16)
+    images.append(('jittered', NumPyImage(pixels ^ jitter)))
+
+    for name, image in images:
+        differing = CheckEncode(name, image)
+        print('%-22s encode %s' % (name, differing and '%d different' % differing or 'ok'))
+        failures += differing
+
+    if failures:
+        sys.exit(1)
+    print('\nThe NumPy codecs match the Python ones')
+
+
+if __name__ == '__main__': main()
@@ -18,9 +18,8 @@ if os.path.isdir(dir): shutil.rmtree(dir)
 os.makedirs(dir)
 
 # exclude QtWebKit to save space, plus Python stuff we don't use
-excludes = ['encodings', 'doctest', 'pdb', 'unittest', 'difflib', 'inspect',
-    'os2emxpath', 'posixpath', 'optpath', 'locale', 'calendar',
-    'threading', 'select', 'socket', 'hashlib', 'multiprocessing', 'ssl',
+excludes = ['encodings', 'doctest', 'pdb', 'unittest', 'difflib',
+    'os2emxpath', 'posixpath', 'optpath', 'calendar', 'ssl',
     'PyQt4.QtWebKit', 'PyQt4.QtNetwork']
 
 # set it up